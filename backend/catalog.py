@@ -0,0 +1,301 @@
+import gzip
+import hashlib
+import sqlite3
+import threading
+import brotli
+import orjson
+from catalog_index import CatalogIndex, find_node
+from search_index import SearchIndex
+import catalog_snapshot
+
+class EncodedCatalog:
+    """The catalog serialized once, plus gzip and brotli copies and a content ETag."""
+    def __init__(self, tree):
+        self.body = orjson.dumps(tree)
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        self.encodings = {
+            "br": brotli.compress(self.body, quality=5),
+            "gzip": gzip.compress(self.body, compresslevel=6)
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Use the bodies stored in a catalog snapshot instead of encoding the tree again."""
+        encoded = cls.__new__(cls)
+        encoded.body = snapshot.body()
+        encoded.etag = snapshot.etag
+        encoded.encodings = {"br": snapshot.body("br"), "gzip": snapshot.body("gzip")}
+        return encoded
+
+    def negotiate(self, accept_encoding):
+        """Return (content_encoding, bytes) for an Accept-Encoding header, preferring brotli."""
+        accepted = set()
+        for part in (accept_encoding or "").split(","):
+            coding, _, params = part.partition(";")
+            try:
+                quality = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+            except ValueError:
+                quality = 1.0
+            if quality > 0:
+                accepted.add(coding.strip().lower())
+        for coding in ("br", "gzip"):
+            if coding in accepted or "*" in accepted:
+                return coding, self.encodings[coding]
+        return None, self.body
+
+class Catalog:
+    """
+    In-memory snapshot of the catalog tree and sync state.
+    The snapshot is replaced after a sync, pruned in place after a delete, and reloaded
+    when the metadata store changed on disk. Changes are detected with PRAGMA data_version on a
+    dedicated read connection, which moves whenever any other connection (in this or
+    another process) commits.
+    On a cold start a binary snapshot file of the current catalog version is memory-mapped
+    instead: /api/movies, /api/tree and /api/item are answered from it directly, and the
+    tree itself is only parsed when something needs all of it (queries, search, sync).
+    """
+    def __init__(self, store, snapshot_path=catalog_snapshot.SNAPSHOT_PATH):
+        self.store = store
+        self.snapshot_path = snapshot_path
+        self.last_sync = None
+        self.version = None
+        self._tree = None
+        self._snapshot = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        # Guards only the data_version connection, so is_fresh() never waits for a build
+        self._version_lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._empty = None
+        self._encoded = None
+        self._index = None
+        # Set when nodes were removed in place: the path index is current, the query orders are not
+        self._index_stale = False
+        # Set when the snapshot file no longer matches the catalog version in memory
+        self._snapshot_dirty = False
+        # The search index outlives snapshots and is synced incrementally to each version
+        self.search = SearchIndex()
+        self._search_version = None
+
+    def _current_data_version(self):
+        with self._version_lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.store.path, check_same_thread=False)
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    @property
+    def tree(self):
+        """The full nested tree (blocking: parses it on first use after a snapshot load)."""
+        with self._lock:
+            return self._full_tree()
+
+    def is_fresh(self):
+        """
+        Cheap check (no parsing) whether the snapshot still matches the store. It does not
+        take the catalog lock, so the event loop never waits for a load or build.
+        """
+        return self._loaded and self._current_data_version() == self._data_version
+
+    def is_empty(self):
+        """Whether the loaded catalog has no items (lock-free once something was loaded)."""
+        if self._empty is None:
+            self.load()
+        return self._empty
+
+    def load(self):
+        """Reload the snapshot from the store (blocking; run it off the event loop)."""
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        # Read the version first so a commit during loading triggers another reload.
+        data_version = self._current_data_version()
+        self._reset()
+        self.last_sync = self.store.get_state("last_sync")
+        self.version = self.store.catalog_version()
+        snapshot = catalog_snapshot.open_snapshot(self.snapshot_path)
+        if snapshot is not None and snapshot.catalog_version == self.version:
+            self._snapshot = snapshot
+            self._snapshot_dirty = False
+        else:
+            self._snapshot_dirty = True
+            try:
+                self._tree = self.store.load_tree()
+            except sqlite3.DatabaseError as e:
+                # Fall back to the last written snapshot instead of an empty library
+                if snapshot is None:
+                    raise
+                print(f"Error reading the catalog from the database, using catalog snapshot {snapshot.catalog_version}: {e}")
+                self._snapshot = snapshot
+                snapshot = None
+            if snapshot is not None:
+                snapshot.close()
+        self._empty = self._snapshot.root_count == 0 if self._tree is None else not self._tree
+        self._data_version = data_version
+        self._loaded = True
+
+    def _reset(self):
+        if self._snapshot is not None:
+            self._snapshot.close()
+        self._snapshot = None
+        self._tree = None
+        self._encoded = None
+        self._index = None
+        self._index_stale = False
+
+    def _full_tree(self):
+        if not self._loaded:
+            self._load()
+        if self._tree is None:
+            self._tree = orjson.loads(self._snapshot.body())
+        return self._tree
+
+    def replace(self, tree):
+        """Install a tree that was just written to the store, without reading it back."""
+        with self._lock:
+            self._reset()
+            self._tree = tree
+            self._empty = not tree
+            self._snapshot_dirty = True
+            self.last_sync = self.store.get_state("last_sync")
+            self.version = self.store.catalog_version()
+            self._data_version = self._current_data_version()
+            self._loaded = True
+
+    def encoded(self):
+        """Serialized and compressed snapshot, built once per catalog version (blocking)."""
+        with self._lock:
+            return self._encoded_snapshot()
+
+    def index(self):
+        """Query indexes over the snapshot, built once per catalog version (blocking)."""
+        with self._lock:
+            return self._query_index()
+
+    def subtree(self, path=None, depth=1):
+        """A node with children down to depth levels, from the snapshot file if the tree is not parsed."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if self._tree is None:
+                return self._snapshot.subtree(path, depth)
+            return self._path_index().subtree(path, depth)
+
+    def item(self, path):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if self._tree is None:
+                return self._snapshot.item(path)
+            return self._path_index().item(path)
+
+    def search_index(self):
+        """Full-text index, updated with only the nodes that changed since it was last synced."""
+        with self._lock:
+            index = self._query_index()
+            if self._search_version != index.version:
+                changed, removed = self.search.sync(index.nodes)
+                if self._search_version is not None:
+                    print(f"Search index updated: {changed} added/changed, {removed} removed")
+                self._search_version = index.version
+            return self.search
+
+    def build(self):
+        """
+        Build the encoded snapshot and indexes ahead of the first request and write the
+        snapshot file for the next cold start.
+        """
+        with self._lock:
+            self._write_snapshot()
+        self.index()
+        self.search_index()
+
+    def save_snapshot(self):
+        """Rewrite the snapshot file if it is behind the catalog, e.g. after remove() (blocking)."""
+        with self._lock:
+            if self._snapshot_dirty or not self._loaded:
+                self._write_snapshot()
+
+    def _write_snapshot(self):
+        tree = self._full_tree()
+        encoded = self._encoded_snapshot()
+        # Unmap our own snapshot first; some platforms refuse to replace a mapped file
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+        try:
+            catalog_snapshot.write_snapshot(tree, self.version, encoded, self.snapshot_path)
+            self._snapshot_dirty = False
+        except OSError as e:
+            print(f"Warning: could not write catalog snapshot: {e}")
+
+    def _encoded_snapshot(self):
+        if self._encoded is None:
+            if not self._loaded:
+                self._load()
+            if self._tree is None:
+                self._encoded = EncodedCatalog.from_snapshot(self._snapshot)
+            else:
+                self._encoded = EncodedCatalog(self._tree)
+        return self._encoded
+
+    def _query_index(self):
+        if self._index is None or self._index_stale:
+            version = self._encoded_snapshot().etag
+            self._index = CatalogIndex(self._full_tree(), version)
+            self._index_stale = False
+        return self._index
+
+    def _path_index(self):
+        """The index for path lookups; after remove() it is still current without a rebuild."""
+        return self._index if self._index is not None else self._query_index()
+
+    def remove(self, paths, was_fresh=True):
+        """
+        Drop nodes (and their descendants) that were just deleted from the store. Only the
+        parents' child lists, the path index and the search index change; the encoded
+        bodies and query orders are rebuilt the next time they are needed, and the snapshot
+        file by save_snapshot(). was_fresh tells whether the catalog matched the store right
+        before the delete; if not, it is reloaded instead.
+        """
+        with self._lock:
+            if not self._loaded or not was_fresh:
+                # The catalog was behind the store already: the next access reloads it
+                self._reset()
+                self._loaded = False
+                self._snapshot_dirty = True
+                return
+            # A snapshot-only catalog is parsed from the mapped body (no database read)
+            self._full_tree()
+            by_path = self._path_index().by_path
+            for path in paths:
+                node = find_node(by_path, path)
+                if node is None:
+                    continue
+                parent = find_node(by_path, path.rstrip("/").rsplit("/", 1)[0] + "/")
+                siblings = parent.get("children") if parent is not None else None
+                if siblings is None or not any(child is node for child in siblings):
+                    siblings = self._tree
+                siblings[:] = [child for child in siblings if child is not node]
+                stack = [node]
+                while stack:
+                    current = stack.pop()
+                    by_path.pop(current["path"], None)
+                    stack.extend(current.get("children") or [])
+                self.search.remove_subtree(node["path"])
+            if self._snapshot is not None:
+                self._snapshot.close()
+                self._snapshot = None
+            self._encoded = None
+            self._index_stale = True
+            self._snapshot_dirty = True
+            self._empty = not self._tree
+            self.version = self.store.catalog_version()
+            # Our own delete moved data_version; read it again rather than forgetting it
+            self._data_version = self._current_data_version()
+
+    def invalidate(self):
+        with self._lock:
+            self._reset()
+            self._loaded = False
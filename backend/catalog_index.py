@@ -0,0 +1,242 @@
+import base64
+import json
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+SORT_KEYS = ("title", "year", "rating", "size", "last_modified")
+QUERY_CACHE_SIZE = 64
+MAX_PAGE_SIZE = 500
+
+def sort_title(node):
+    return (node.get("title") or node.get("name") or "").casefold()
+
+def parse_year(node):
+    try:
+        return int(str(node.get("year"))[:4])
+    except (TypeError, ValueError):
+        return None
+
+def parse_rating(node):
+    try:
+        return float(node.get("imdb"))
+    except (TypeError, ValueError):
+        return None
+
+def parse_size(node):
+    size = node.get("size")
+    return size if isinstance(size, (int, float)) else None
+
+def parse_last_modified(node):
+    try:
+        return parsedate_to_datetime(node.get("last_modified")).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+SORT_VALUES = {
+    "title": sort_title,
+    "year": parse_year,
+    "rating": parse_rating,
+    "size": parse_size,
+    "last_modified": parse_last_modified
+}
+
+def split_values(value):
+    """Split an OMDb list field ("Action, Drama") into casefolded tokens."""
+    return [part.strip().casefold() for part in (value or "").split(",") if part.strip() and part.strip() != "N/A"]
+
+def encode_cursor(version, rank):
+    raw = json.dumps({"v": version, "r": rank}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return data["v"], int(data["r"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def path_keys(path):
+    """Keys a node path may be stored under: as given, without and with the folder slash."""
+    bare = path.rstrip("/")
+    return (path, bare, bare + "/")
+
+def find_node(by_path, path):
+    for key in path_keys(path):
+        node = by_path.get(key)
+        if node is not None:
+            return node
+    return None
+
+def truncate_node(node, depth):
+    """Copy a node, keeping children only depth levels deep."""
+    item = {key: value for key, value in node.items() if key != "children"}
+    if "children" in node:
+        children = node["children"] or []
+        item["child_count"] = len(children)
+        if depth > 0:
+            item["children"] = [truncate_node(child, depth - 1) for child in children]
+    return item
+
+class StaleCursorError(ValueError):
+    """Raised when a cursor was issued for an older catalog version."""
+
+class CatalogIndex:
+    """
+    Flat, indexed view of one catalog version for /api/query, /api/tree and /api/item.
+    by_path maps every path to its node in the nested tree for O(1) lookups.
+    Every node gets an integer id; each sort key has a precomputed order (and the rank of
+    every id in it), type/genre/language map to id sets, and year/rating are kept as
+    sorted (value, id) arrays for range filters. A query intersects the id sets, orders
+    the candidates by rank and pages with a cursor that holds the last returned rank.
+    """
+    def __init__(self, tree, version):
+        self.version = version
+        self.tree = tree
+        self.nodes = []
+        self.by_path = {}
+        self._flatten(tree)
+
+        self.orders = {}
+        self.ranks = {}
+        for key in SORT_KEYS:
+            value_of = SORT_VALUES[key]
+            present, missing = [], []
+            for node_id, node in enumerate(self.nodes):
+                value = value_of(node)
+                (missing if value is None else present).append((value, sort_title(node), node["path"], node_id))
+            present.sort()
+            missing.sort(key=lambda entry: (entry[1], entry[2]))
+            # Items without a value go last in both directions.
+            asc = [entry[3] for entry in present] + [entry[3] for entry in missing]
+            desc = [entry[3] for entry in reversed(present)] + [entry[3] for entry in missing]
+            for direction, order in (("asc", asc), ("desc", desc)):
+                self.orders[(key, direction)] = order
+                rank = [0] * len(order)
+                for position, node_id in enumerate(order):
+                    rank[node_id] = position
+                self.ranks[(key, direction)] = rank
+
+        self.by_type = {}
+        self.by_genre = {}
+        self.by_language = {}
+        for node_id, node in enumerate(self.nodes):
+            self.by_type.setdefault((node.get("type") or "").casefold(), set()).add(node_id)
+            for genre in split_values(node.get("genre")):
+                self.by_genre.setdefault(genre, set()).add(node_id)
+            for language in split_values(node.get("language")):
+                self.by_language.setdefault(language, set()).add(node_id)
+
+        self.ranges = {}
+        for key, value_of in (("year", parse_year), ("rating", parse_rating)):
+            entries = sorted((value, node_id) for node_id, node in enumerate(self.nodes) if (value := value_of(node)) is not None)
+            self.ranges[key] = ([value for value, _ in entries], [node_id for _, node_id in entries])
+
+        self._results = OrderedDict()
+        self._results_lock = threading.Lock()
+
+    def _flatten(self, nodes, parent=None):
+        for node in nodes:
+            item = {key: value for key, value in node.items() if key != "children"}
+            item["parent"] = parent
+            if node.get("type") == "FOLDER" or "children" in node:
+                item["child_count"] = len(node.get("children") or [])
+            self.nodes.append(item)
+            self.by_path[node["path"]] = node
+            if node.get("children"):
+                self._flatten(node["children"], node["path"])
+
+    def item(self, path):
+        """A single node without its children (O(1) through the path index)."""
+        node = find_node(self.by_path, path)
+        if node is None:
+            return None
+        return truncate_node(node, 0)
+
+    def subtree(self, path=None, depth=1):
+        """
+        A node with its descendants down to depth levels (or the top level of the
+        library when path is empty). Deeper folders only carry their child_count.
+        """
+        if not path or path == "/":
+            return {"path": "/", "children": [truncate_node(node, depth - 1) for node in self.tree], "child_count": len(self.tree)}
+        node = find_node(self.by_path, path)
+        if node is None:
+            return None
+        return truncate_node(node, depth)
+
+    def _range_ids(self, key, low, high):
+        values, ids = self.ranges[key]
+        start = bisect_left(values, low) if low is not None else 0
+        end = bisect_right(values, high) if high is not None else len(values)
+        return set(ids[start:end])
+
+    def _candidates(self, filters):
+        """Intersect the id sets of all active filters; None means "no filter"."""
+        sets = []
+        for param, index in (("type", self.by_type), ("genre", self.by_genre), ("language", self.by_language)):
+            if filters.get(param):
+                wanted = split_values(filters[param])
+                sets.append(set().union(*(index.get(value, set()) for value in wanted)))
+        for key in ("year", "rating"):
+            low, high = filters.get(f"{key}_min"), filters.get(f"{key}_max")
+            if low is not None or high is not None:
+                sets.append(self._range_ids(key, low, high))
+        if not sets:
+            return None
+        sets.sort(key=len)
+        result = set(sets[0])
+        for other in sets[1:]:
+            result &= other
+        return result
+
+    def _ordered_ranks(self, filters, sort_key):
+        """Ranks of all matching ids in sort order, memoized per (filters, sort)."""
+        cache_key = (tuple(sorted(filters.items())), sort_key)
+        with self._results_lock:
+            if cache_key in self._results:
+                self._results.move_to_end(cache_key)
+                return self._results[cache_key]
+        candidates = self._candidates(filters)
+        if candidates is None:
+            return None
+        rank = self.ranks[sort_key]
+        ordered = sorted(rank[node_id] for node_id in candidates)
+        with self._results_lock:
+            self._results[cache_key] = ordered
+            if len(self._results) > QUERY_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return ordered
+
+    def query(self, filters, sort="title", direction="asc", limit=50, cursor=None):
+        """Return one page: {"items", "total", "next_cursor", "version"}."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        if direction not in ("asc", "desc"):
+            raise ValueError(f"Unknown sort direction: {direction}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        filters = {key: value for key, value in filters.items() if value is not None and value != ""}
+        sort_key = (sort, direction)
+        after = -1
+        if cursor:
+            cursor_version, after = decode_cursor(cursor)
+            if cursor_version != self.version:
+                raise StaleCursorError("The catalog changed since this cursor was issued")
+
+        order = self.orders[sort_key]
+        ordered_ranks = self._ordered_ranks(filters, sort_key)
+        if ordered_ranks is None:
+            # No filters: the sort order itself is the result.
+            page_ranks = range(after + 1, min(after + 1 + limit, len(order)))
+            total = len(order)
+            has_more = after + 1 + limit < len(order)
+        else:
+            start = bisect_right(ordered_ranks, after)
+            page_ranks = ordered_ranks[start:start + limit]
+            total = len(ordered_ranks)
+            has_more = start + limit < len(ordered_ranks)
+
+        items = [self.nodes[order[rank]] for rank in page_ranks]
+        next_cursor = encode_cursor(self.version, page_ranks[-1]) if has_more and items else None
+        return {"items": items, "total": total, "next_cursor": next_cursor, "version": self.version}
@@ -0,0 +1,156 @@
+import os
+import mmap
+import struct
+import orjson
+from catalog_index import path_keys
+
+# Binary catalog snapshot written after each sync and memory-mapped on startup
+SNAPSHOT_PATH = os.path.join(os.getcwd(), "catalog.snapshot")
+MAGIC = b"MCSNAP01"
+
+# magic, catalog version, node count, root count, etag, then (offset, length) of the
+# node table, path index, string pool, JSON body, gzip body and brotli body
+HEADER = struct.Struct("<8sQII20s4x12Q")
+# path offset/length and data offset/length in the string pool, parent index,
+# first child index, child count, flags
+NODE = struct.Struct("<QIQIiIIB")
+PATH_INDEX = struct.Struct("<I")
+HAS_CHILDREN = 1
+NO_PARENT = -1
+
+def write_snapshot(tree, catalog_version, encoded, path=SNAPSHOT_PATH):
+    """
+    Write the tree as a snapshot: a fixed-size record per node in breadth-first order
+    (so the children of a node are one contiguous range), a path index sorted by path
+    for binary search, a string pool with paths and per-node JSON, and the encoded
+    catalog bodies. Written to a temp file and renamed into place.
+    """
+    order = [(node, NO_PARENT) for node in tree]
+    records = []
+    pool = bytearray()
+    position = 0
+    while position < len(order):
+        node, parent = order[position]
+        children = node.get("children")
+        first_child = len(order)
+        if children:
+            order.extend((child, position) for child in children)
+        path_bytes = node["path"].encode()
+        data_bytes = orjson.dumps({key: value for key, value in node.items() if key != "children"})
+        records.append((len(pool), len(path_bytes), len(pool) + len(path_bytes), len(data_bytes), parent,
+                        first_child, len(children or []), HAS_CHILDREN if "children" in node else 0))
+        pool += path_bytes
+        pool += data_bytes
+        position += 1
+
+    path_order = sorted(range(len(order)), key=lambda index: order[index][0]["path"].encode())
+    sections = [
+        b"".join(NODE.pack(*record) for record in records),
+        b"".join(PATH_INDEX.pack(index) for index in path_order),
+        bytes(pool),
+        encoded.body,
+        encoded.encodings["gzip"],
+        encoded.encodings["br"]
+    ]
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offsets += [offset, len(section)]
+        offset += len(section)
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, catalog_version, len(order), len(tree), encoded.etag.encode()[:20], *offsets))
+        for section in sections:
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def open_snapshot(path=SNAPSHOT_PATH):
+    """Map a snapshot file; returns None if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return CatalogSnapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Warning: ignoring catalog snapshot: {e}")
+        return None
+
+class CatalogSnapshot:
+    """Read-only view of a snapshot file; nodes are decoded only when they are asked for."""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self._mm, 0)
+        if header[0] != MAGIC:
+            self.close()
+            raise ValueError("not a catalog snapshot")
+        self.catalog_version, self.node_count, self.root_count = header[1:4]
+        self.etag = header[4].decode()
+        sections = header[5:]
+        (self._nodes, _), (self._paths, _), (self._pool, _) = (sections[0:2], sections[2:4], sections[4:6])
+        self._bodies = {
+            None: sections[6:8],
+            "gzip": sections[8:10],
+            "br": sections[10:12]
+        }
+
+    def close(self):
+        self._mm.close()
+
+    def body(self, encoding=None):
+        offset, length = self._bodies[encoding]
+        return self._mm[offset:offset + length]
+
+    def _record(self, index):
+        return NODE.unpack_from(self._mm, self._nodes + index * NODE.size)
+
+    def _path_bytes(self, record):
+        start = self._pool + record[0]
+        return self._mm[start:start + record[1]]
+
+    def find(self, path):
+        """Binary search the path index; returns the node index or None."""
+        target = path.encode()
+        low, high = 0, self.node_count
+        while low < high:
+            middle = (low + high) // 2
+            index = PATH_INDEX.unpack_from(self._mm, self._paths + middle * PATH_INDEX.size)[0]
+            current = self._path_bytes(self._record(index))
+            if current < target:
+                low = middle + 1
+            elif current > target:
+                high = middle
+            else:
+                return index
+        return None
+
+    def node(self, index, depth=0):
+        """Decode one node, with its children down to depth levels (like catalog_index.truncate_node)."""
+        record = self._record(index)
+        start = self._pool + record[2]
+        item = orjson.loads(self._mm[start:start + record[3]])
+        if record[7] & HAS_CHILDREN:
+            item["child_count"] = record[6]
+            if depth > 0:
+                item["children"] = [self.node(child, depth - 1) for child in range(record[5], record[5] + record[6])]
+        return item
+
+    def find_node(self, path):
+        """Like find(), also trying the path without or with a trailing folder slash."""
+        for key in path_keys(path):
+            index = self.find(key)
+            if index is not None:
+                return index
+        return None
+
+    def item(self, path):
+        index = self.find_node(path)
+        return self.node(index) if index is not None else None
+
+    def subtree(self, path=None, depth=1):
+        if not path or path == "/":
+            return {"path": "/", "children": [self.node(index, depth - 1) for index in range(self.root_count)], "child_count": self.root_count}
+        index = self.find_node(path)
+        return self.node(index, depth) if index is not None else None
@@ -1,20 +1,33 @@
 import os
 import json
 import datetime
+import time
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
 from collections import OrderedDict
 from math import floor
 import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from urllib.parse import unquote, urljoin, urlparse
 import requests
 from requests.auth import HTTPBasicAuth
-from guessit import guessit
+from guessit import guessit, __version__ as guessit_version
 from dotenv import load_dotenv
+import posters
+from metadata_store import get_store
 
 # Load environment variables.
 load_dotenv()
 
 # OMDb and posters configuration.
 omdb_api_key = os.getenv('omdb_api_key')
+# Base URL under which the backend (and so /posters) is reachable by clients.
+public_base_url = os.getenv('PUBLIC_BASE_URL', 'http://127.0.0.1:50005').rstrip('/')
+# Maximum number of concurrent OMDb lookups (and poster downloads) during enrichment.
+omdb_concurrency = max(1, int(os.getenv('OMDB_CONCURRENCY', '8')))
+# Maximum number of OMDb requests per second.
+omdb_rate_limit = float(os.getenv('OMDB_RATE_LIMIT', '10'))
 posters_dir = os.path.join(os.path.dirname(__file__), "posters")
 if not os.path.exists(posters_dir):
     os.makedirs(posters_dir)
@@ -32,6 +45,11 @@ webdav_url = os.getenv('WEBDAV_URL')
 if not all([webdav_username, webdav_password, webdav_url]):
     raise Exception("WebDAV credentials not set in .env")
 
+# Maximum number of concurrent Depth: 1 PROPFIND requests when walking the collection tree.
+crawl_concurrency = max(1, int(os.getenv('WEBDAV_CRAWL_CONCURRENCY', '8')))
+# Set WEBDAV_DEPTH_INFINITY=false for servers that disable Depth: infinity to skip straight to the parallel crawl.
+depth_infinity_enabled = os.getenv('WEBDAV_DEPTH_INFINITY', 'true').lower() not in ('0', 'false', 'no')
+
 # Define file type extension lists.
 VIDEO_EXTENSIONS = ['3g2', '3gp', 'avi', 'flv', 'm2ts', 'm4v', 'mj2', 'mkv', 'mov', 'mp4',
                     'mpeg', 'mpg', 'ogv', 'rmvb', 'ts', 'webm', 'wmv', 'y4m']
@@ -51,7 +69,8 @@ def determine_file_type(name):
 
 headers = {
     'Depth': 'infinity',
-    'Content-Type': 'text/xml'
+    'Content-Type': 'text/xml',
+    'Accept-Encoding': 'gzip'
 }
 body = '''<?xml version="1.0" encoding="utf-8" ?>
 <propfind xmlns="DAV:">
@@ -59,67 +78,98 @@ body = '''<?xml version="1.0" encoding="utf-8" ?>
     <displayname/>
     <getlastmodified/>
     <getcontentlength/>
+    <getetag/>
     <resourcetype/>
   </prop>
 </propfind>'''
 
-def retrieve_webdav_tree():
-    """Retrieve all WebDAV data and build a nested tree structure with guessit info."""
-    response = requests.request(
-        'PROPFIND',
-        webdav_url,
-        headers=headers,
-        data=body,
-        auth=HTTPBasicAuth(webdav_username, webdav_password),
-        timeout=60
-    )
-    if response.status_code != 207:
-        raise Exception(f"Error retrieving WebDAV data: status {response.status_code}")
-    root_elem = ET.fromstring(response.content)
-    ns = {'d': 'DAV:'}
+DAV_NS = '{DAV:}'
+# Size of the chunks read from the PROPFIND response while streaming.
+STREAM_CHUNK_SIZE = 64 * 1024
 
-    def parse_response(elem):
-        items = []
-        for resp in elem.findall('d:response', ns):
-            href_elem = resp.find('d:href', ns)
-            if href_elem is None:
-                continue
-            href = href_elem.text
+def parse_propfind_response(resp):
+    """Convert a single <d:response> element into a flat item dict (or None if it has no href)."""
+    href_elem = resp.find(f'{DAV_NS}href')
+    if href_elem is None:
+        return None
+    href = href_elem.text
 
-            prop = resp.find('d:propstat/d:prop', ns)
-            displayname_elem = prop.find('d:displayname', ns) if prop is not None else None
-            displayname = displayname_elem.text if displayname_elem is not None else ''
+    prop = resp.find(f'{DAV_NS}propstat/{DAV_NS}prop')
+    displayname_elem = prop.find(f'{DAV_NS}displayname') if prop is not None else None
+    displayname = displayname_elem.text if displayname_elem is not None else ''
 
-            last_modified_elem = prop.find('d:getlastmodified', ns) if prop is not None else None
-            last_modified = last_modified_elem.text if last_modified_elem is not None else ''
+    last_modified_elem = prop.find(f'{DAV_NS}getlastmodified') if prop is not None else None
+    last_modified = last_modified_elem.text if last_modified_elem is not None else ''
 
-            content_length_elem = prop.find('d:getcontentlength', ns) if prop is not None else None
-            try:
-                size = int(content_length_elem.text) if (content_length_elem is not None and content_length_elem.text) else 0
-            except ValueError:
-                size = 0
+    content_length_elem = prop.find(f'{DAV_NS}getcontentlength') if prop is not None else None
+    try:
+        size = int(content_length_elem.text) if (content_length_elem is not None and content_length_elem.text) else 0
+    except ValueError:
+        size = 0
 
-            resourcetype = prop.find('d:resourcetype', ns) if prop is not None else None
-            is_collection = (resourcetype is not None and resourcetype.find('d:collection', ns) is not None)
+    etag_elem = prop.find(f'{DAV_NS}getetag') if prop is not None else None
+    etag = etag_elem.text if (etag_elem is not None and etag_elem.text) else ''
 
-            if is_collection:
-                item_type = "FOLDER"
-            else:
-                candidate = displayname if displayname else os.path.basename(href.rstrip('/'))
-                item_type = determine_file_type(candidate)
-            name = displayname if displayname else os.path.basename(href.rstrip('/'))
-
-            items.append({
-                "href": href,
-                "name": name,
-                "last_modified": last_modified,
-                "type": item_type,
-                "size": size
-            })
-        return items
-
-    flat_items = parse_response(root_elem)
-    # Build nested tree from flat items using href paths.
+    resourcetype = prop.find(f'{DAV_NS}resourcetype') if prop is not None else None
+    is_collection = (resourcetype is not None and resourcetype.find(f'{DAV_NS}collection') is not None)
+
+    name = displayname if displayname else os.path.basename(href.rstrip('/'))
+    if is_collection:
+        item_type = "FOLDER"
+    else:
+        item_type = determine_file_type(name)
+
+    return {
+        "href": href,
+        "name": name,
+        "last_modified": last_modified,
+        "type": item_type,
+        "size": size,
+        "etag": etag
+    }
+
+def iter_propfind_items(response):
+    """
+    Incrementally parse a streamed PROPFIND response and yield flat items.
+    Each <d:response> element is cleared as soon as it has been converted, so memory
+    stays bounded by the chunk size instead of the size of the whole multistatus body.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    # decode_content makes urllib3 transparently gunzip the body.
+    response.raw.decode_content = True
+    while True:
+        chunk = response.raw.read(STREAM_CHUNK_SIZE)
+        if chunk:
+            parser.feed(chunk)
+        else:
+            parser.close()
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag != f'{DAV_NS}response':
+                continue
+            item = parse_propfind_response(elem)
+            # Drop the finished element (and any already-processed siblings) from the tree.
+            elem.clear()
+            root.clear()
+            if item is not None:
+                yield item
+        if not chunk:
+            break
+
+def iter_buffered_propfind_items(content):
+    """Parse a fully buffered PROPFIND response body and yield flat items."""
+    root_elem = ET.fromstring(content)
+    for resp in root_elem.findall(f'{DAV_NS}response'):
+        item = parse_propfind_response(resp)
+        if item is not None:
+            yield item
+
+def build_nested_tree(flat_items):
+    """Build a nested tree from (an iterable of) flat items using their href paths."""
     nodes = {}
     for item in flat_items:
         path = item["href"]
@@ -141,138 +191,812 @@ def retrieve_webdav_tree():
             tree_list.append(node)
         else:
             nodes[parent_path].setdefault("children", []).append(node)
-    # Compute folder sizes recursively.
-    def compute_folder_size(node):
-        if node["type"] != "FOLDER":
-            return node.get("size", 0)
-        total = 0
+    return tree_list
+
+def compute_folder_size(node):
+    """Compute folder sizes recursively."""
+    if node["type"] != "FOLDER":
+        return node.get("size", 0)
+    total = 0
+    for child in node.get("children", []):
+        total += compute_folder_size(child)
+    node["size"] = total
+    return total
+
+# --- Atomic JSON Files ---
+
+# Serializes writers of the JSON state files (crawl state, guessit cache)
+json_write_lock = threading.Lock()
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """
+    Write JSON to a temp file, fsync it and rename it over path, so readers and crashes
+    only ever see the old or the new complete file, never a truncated one.
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with json_write_lock:
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(data, f, **dump_kwargs)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+# --- Guessit Parsing & Caching ---
+
+# Guessit keys that are kept on the tree nodes.
+GUESSIT_KEYS = ("title", "year", "source", "season", "episode", "episode_title", "type")
+# Below this number of uncached names, parsing in-process is cheaper than starting a process pool.
+GUESSIT_POOL_THRESHOLD = 256
+guessit_cache_lock = threading.Lock()
+
+def guess_name(name):
+    """Run guessit on a single name and keep only the keys used by the tree."""
+    try:
+        g = guessit(name)
+    except Exception as e:
+        print(f"Guessit error for {name}: {e}")
+        return {}
+    return {key: g[key] for key in GUESSIT_KEYS if key in g and g[key]}
+
+def load_guessit_cache():
+    """Load cached guessit results; results from another guessit version are discarded."""
+    guessit_cache_path = os.path.join(os.getcwd(), "guessit_cache.json")
+    if os.path.exists(guessit_cache_path):
+        try:
+            with open(guessit_cache_path, "r") as f:
+                cache = json.load(f)
+            if cache.get("version") == guessit_version:
+                return cache.get("names", {})
+        except (json.JSONDecodeError, AttributeError):
+            print("Warning: guessit_cache.json is invalid, ignoring it")
+    return {}
+
+def save_guessit_cache(names):
+    guessit_cache_path = os.path.join(os.getcwd(), "guessit_cache.json")
+    write_json_atomic(guessit_cache_path, {"version": guessit_version, "names": names})
+
+def guess_names(names):
+    """
+    Return guessit results for all names. Cached results are reused and the
+    remaining names are parsed across a process pool when there are enough of them.
+    New results are merged into the cache, so backends finalized one after another
+    keep each other's entries; prune_guessit_cache() drops names that are gone.
+    """
+    cache = load_guessit_cache()
+    guesses = {}
+    misses = []
+    for name in names:
+        if name in cache:
+            guesses[name] = cache[name]
+        else:
+            misses.append(name)
+
+    workers = os.cpu_count() or 1
+    if workers > 1 and len(misses) >= GUESSIT_POOL_THRESHOLD:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, len(misses) // (workers * 4))
+                for name, guess in zip(misses, executor.map(guess_name, misses, chunksize=chunksize)):
+                    guesses[name] = guess
+        except Exception as e:
+            print(f"Guessit process pool failed, parsing in-process: {e}")
+    for name in misses:
+        if name not in guesses:
+            guesses[name] = guess_name(name)
+
+    if misses:
+        with guessit_cache_lock:
+            cache = load_guessit_cache()
+            cache.update((name, guesses[name]) for name in misses)
+            save_guessit_cache(cache)
+    return guesses
+
+def prune_guessit_cache(tree):
+    """Keep only the guessit results of names in tree (the union of all library backends)."""
+    names = set()
+    for node in tree:
+        collect_names(node, names)
+    with guessit_cache_lock:
+        cache = load_guessit_cache()
+        kept = {name: guess for name, guess in cache.items() if name in names}
+        if len(kept) != len(cache):
+            save_guessit_cache(kept)
+
+def collect_names(node, names):
+    names.add(node["name"])
+    for child in node.get("children", []):
+        collect_names(child, names)
+
+def process_node(node, guesses):
+    """Build the final node (and its children) from the tree node and its guessit results."""
+    g = guesses.get(node["name"], {})
+    new_node = OrderedDict()
+    new_node["name"] = node["name"]
+    new_node["title"] = g.get("title")
+    new_node["year"] = g.get("year")
+    new_node["source"] = g.get("source")
+    # Always include "season" key for every node (file or folder)
+    new_node["season"] = g.get("season")
+    # For file nodes, add additional keys if available.
+    if node["type"] != "FOLDER":
+        new_node["episode"] = g.get("episode")
+        new_node["episode_title"] = g.get("episode_title")
+    new_node["path"] = node["path"]
+    new_node["last_modified"] = node["last_modified"]
+    if node["type"] == "FOLDER":
+        new_node["type"] = "FOLDER"
+    else:
+        guessit_type = g.get("type", "").lower()
+        new_node["type"] = guessit_type  # Will later be updated by OMDb.
+        new_node["file-type"] = node["type"]
+    new_node["size"] = node["size"]
+    if node["type"] == "FOLDER":
+        children = []
         for child in node.get("children", []):
-            total += compute_folder_size(child)
-        node["size"] = total
-        return total
+            children.append(process_node(child, guesses))
+        new_node["children"] = children
+    return new_node
+
+def finalize_tree(tree_list):
+    """Compute folder sizes, run guessit over every node and strip a single top-level folder."""
+    names = set()
     for node in tree_list:
         compute_folder_size(node)
-    # Process each node with guessit and reassemble keys.
-    def process_node(node):
-        try:
-            g = guessit(node["name"])
-        except Exception as e:
-            print(f"Guessit error for {node['name']}: {e}")
-            g = {}
-        new_node = OrderedDict()
-        new_node["name"] = node["name"]
-        new_node["title"] = g.get("title") if "title" in g and g["title"] else None
-        new_node["year"] = g.get("year") if "year" in g and g["year"] else None
-        new_node["source"] = g.get("source") if "source" in g and g["source"] else None
-        # Always include "season" key for every node (file or folder)
-        new_node["season"] = g.get("season") if "season" in g and g["season"] else None
-        # For file nodes, add additional keys if available.
-        if node["type"] != "FOLDER":
-            new_node["episode"] = g.get("episode") if "episode" in g and g["episode"] else None
-            new_node["episode_title"] = g.get("episode_title") if "episode_title" in g and g["episode_title"] else None
-        new_node["path"] = node["path"]
-        new_node["last_modified"] = node["last_modified"]
-        if node["type"] == "FOLDER":
-            new_node["type"] = "FOLDER"
-        else:
-            guessit_type = g.get("type", "").lower()
-            new_node["type"] = guessit_type  # Will later be updated by OMDb.
-            new_node["file-type"] = node["type"]
-        new_node["size"] = node["size"]
-        if node["type"] == "FOLDER":
-            children = []
-            for child in node.get("children", []):
-                children.append(process_node(child))
-            new_node["children"] = children
-        return new_node
-
-    final_tree = [process_node(node) for node in tree_list]
+        collect_names(node, names)
+    guesses = guess_names(names)
+    final_tree = [process_node(node, guesses) for node in tree_list]
     # If there is only one top-level folder, skip it by returning its children
     if len(final_tree) == 1 and final_tree[0]["type"] == "FOLDER":
         final_tree = final_tree[0].get("children", [])
     return final_tree
 
-def cleanup_orphaned_posters(current_tree, previous_tree, db_cache):
+# Status codes with which servers refuse a Depth: infinity PROPFIND (RFC 4918 propfind-finite-depth).
+DEPTH_INFINITY_REJECTED_STATUSES = (400, 403, 501)
+
+def retrieve_webdav_tree(stream=True):
     """
-    Compare current and previous media trees to find deleted items and remove their poster files.
-    
-    Args:
-        current_tree: The newly retrieved WebDAV tree
-        previous_tree: The previous tree from database.json
-        db_cache: The OMDb API cache dictionary
-    
+    Retrieve all WebDAV data and build a nested tree structure with guessit info.
+    With stream=True (the default) the PROPFIND body is parsed while it is being
+    downloaded and flat items are fed straight into the tree builder; stream=False
+    buffers the whole response first.
+    If the server rejects Depth: infinity, the tree is crawled with parallel Depth: 1
+    requests instead (see retrieve_webdav_tree_parallel).
+    The per-folder listing is saved as crawl state for retrieve_webdav_tree_incremental.
+    """
+    if not depth_infinity_enabled:
+        return retrieve_webdav_tree_parallel()
+    try:
+        response = requests.request(
+            'PROPFIND',
+            webdav_url,
+            headers=headers,
+            data=body,
+            auth=HTTPBasicAuth(webdav_username, webdav_password),
+            timeout=60,
+            stream=stream
+        )
+    except requests.Timeout:
+        print("Depth: infinity PROPFIND timed out, falling back to a parallel Depth: 1 crawl")
+        return retrieve_webdav_tree_parallel()
+    if response.status_code in DEPTH_INFINITY_REJECTED_STATUSES:
+        response.close()
+        print(f"Server rejected Depth: infinity (status {response.status_code}), falling back to a parallel Depth: 1 crawl")
+        return retrieve_webdav_tree_parallel()
+    crawl_state = new_crawl_state()
+    try:
+        if response.status_code != 207:
+            raise Exception(f"Error retrieving WebDAV data: status {response.status_code}")
+        if stream:
+            flat_items = iter_propfind_items(response)
+        else:
+            flat_items = iter_buffered_propfind_items(response.content)
+        tree_list = build_nested_tree(record_crawl_state(flat_items, crawl_state))
+    finally:
+        response.close()
+    save_crawl_state(crawl_state)
+    return finalize_tree(tree_list)
+
+def retrieve_webdav_tree_parallel(concurrency=None):
+    """
+    Retrieve the WebDAV tree by walking the collection tree with concurrent Depth: 1
+    PROPFIND requests. Builds the same nested tree as retrieve_webdav_tree.
+    """
+    crawl_state = new_crawl_state()
+    root_item, root_children = list_collection(urlparse(webdav_url).path)
+    if root_item is None:
+        raise Exception("Error retrieving WebDAV data: empty PROPFIND response")
+    crawl_state["root"] = root_item
+    requests_made = 1 + walk_collections(root_item, root_children, crawl_state, concurrency=concurrency)
+    print(f"Parallel crawl finished with {requests_made} PROPFIND request(s)")
+
+    tree_list = build_nested_tree(iter_crawl_state_items(crawl_state))
+    save_crawl_state(crawl_state)
+    return finalize_tree(tree_list)
+
+# --- Depth: 1 and Incremental Crawling ---
+
+def load_crawl_state():
+    crawl_state_path = os.path.join(os.getcwd(), "crawl_state.json")
+    if os.path.exists(crawl_state_path):
+        try:
+            with open(crawl_state_path, "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print("Warning: crawl_state.json is invalid, ignoring it")
+    return new_crawl_state()
+
+def save_crawl_state(crawl_state):
+    crawl_state_path = os.path.join(os.getcwd(), "crawl_state.json")
+    write_json_atomic(crawl_state_path, crawl_state)
+
+def new_crawl_state():
+    """
+    The crawl state remembers the listing of every collection from the previous run:
+    "root" is the flat item of the crawled collection itself and "folders" maps each
+    collection href to its etag, last_modified and the flat items of its direct children.
+    """
+    return {"root": None, "folders": {}}
+
+def parent_href(href):
+    return os.path.dirname(href.rstrip('/')) + '/'
+
+def add_folder_to_state(crawl_state, item):
+    crawl_state["folders"][item["href"]] = {
+        "etag": item.get("etag", ''),
+        "last_modified": item["last_modified"],
+        "children": []
+    }
+
+def record_crawl_state(flat_items, crawl_state):
+    """Pass flat items through unchanged while recording them into the crawl state."""
+    folders = crawl_state["folders"]
+    for item in flat_items:
+        if crawl_state["root"] is None:
+            # The first response of a PROPFIND is the requested collection itself.
+            crawl_state["root"] = item
+        else:
+            parent = folders.get(parent_href(item["href"]))
+            if parent is not None:
+                parent["children"].append(item)
+        if item["type"] == "FOLDER":
+            add_folder_to_state(crawl_state, item)
+        yield item
+
+def iter_crawl_state_items(crawl_state):
+    """Yield every flat item stored in the crawl state, root first."""
+    if crawl_state["root"] is None:
+        return
+    yield crawl_state["root"]
+    for folder in crawl_state["folders"].values():
+        yield from folder["children"]
+
+def same_href(a, b):
+    return unquote(a).rstrip('/') == unquote(b).rstrip('/')
+
+_thread_local = threading.local()
+
+def get_session():
+    """Return a per-thread requests session so crawl workers reuse their keep-alive connections."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.auth = HTTPBasicAuth(webdav_username, webdav_password)
+        _thread_local.session = session
+    return session
+
+def list_collection(href):
+    """List a single collection with a Depth: 1 PROPFIND; returns (own item, child items)."""
+    response = get_session().request(
+        'PROPFIND',
+        urljoin(webdav_url, href),
+        headers={**headers, 'Depth': '1'},
+        data=body,
+        timeout=60
+    )
+    if response.status_code != 207:
+        raise Exception(f"Error listing WebDAV collection {href}: status {response.status_code}")
+    own_item = None
+    children = []
+    for item in iter_buffered_propfind_items(response.content):
+        if own_item is None and same_href(item["href"], href):
+            own_item = item
+        else:
+            children.append(item)
+    if own_item is None and children:
+        # Fall back to the first response being the collection itself.
+        own_item = children.pop(0)
+    return own_item, children
+
+etag_probe_body = '''<?xml version="1.0" encoding="utf-8" ?>
+<propfind xmlns="DAV:" xmlns:oc="http://owncloud.org/ns">
+  <prop>
+    <oc:id/>
+  </prop>
+</propfind>'''
+
+OC_NS = '{http://owncloud.org/ns}'
+_etag_propagation = {}
+
+def server_propagates_etags(href):
+    """
+    Whether a change anywhere below a collection also changes the collection's own etag.
+    Nextcloud/ownCloud do this and are recognized by their oc:id property; plain WebDAV
+    servers (e.g. Apache mod_dav) only update the folder whose direct members changed,
+    so unchanged-looking folders there may still hide changes deeper down.
+    The answer is probed once per process with a Depth: 0 PROPFIND.
+    """
+    if href not in _etag_propagation:
+        propagates = False
+        try:
+            response = get_session().request(
+                'PROPFIND',
+                urljoin(webdav_url, href),
+                headers={**headers, 'Depth': '0'},
+                data=etag_probe_body,
+                timeout=60
+            )
+            if response.status_code == 207:
+                for propstat in ET.fromstring(response.content).iter(f'{DAV_NS}propstat'):
+                    status = propstat.find(f'{DAV_NS}status')
+                    oc_id = propstat.find(f'{DAV_NS}prop/{OC_NS}id')
+                    if status is not None and ' 200 ' in (status.text or '') and oc_id is not None and oc_id.text:
+                        propagates = True
+        except (requests.RequestException, ET.ParseError) as e:
+            print(f"Could not probe the WebDAV server for etag propagation: {e}")
+        _etag_propagation[href] = propagates
+    return _etag_propagation[href]
+
+def folder_unchanged(previous_folder, item):
+    """A folder can be reused only if the server reports an etag and neither tag changed."""
+    return (
+        previous_folder is not None
+        and item.get("etag")
+        and previous_folder.get("etag") == item.get("etag")
+        and previous_folder.get("last_modified") == item["last_modified"]
+    )
+
+def copy_cached_subtree(href, previous_state, crawl_state):
+    """Copy a folder and all of its descendant folders from the previous crawl state."""
+    pending = [href]
+    while pending:
+        folder_href = pending.pop()
+        folder = previous_state["folders"].get(folder_href)
+        if folder is None:
+            continue
+        crawl_state["folders"][folder_href] = folder
+        for child in folder["children"]:
+            if child["type"] == "FOLDER":
+                pending.append(child["href"])
+
+def walk_collections(folder_item, children, crawl_state, reuse_folder=None, concurrency=None, list_folder=None):
+    """
+    Record a listed collection into the crawl state and list all of its descendant
+    collections with Depth: 1 PROPFINDs through a bounded worker pool.
+    reuse_folder(child) may return True to skip listing a child collection (and its subtree).
+    list_folder(href) replaces the PROPFIND listing for other backends (see local_library.py).
+    Returns the number of listings made.
+    """
+    list_folder = list_folder or list_collection
+    requests_made = 0
+    with ThreadPoolExecutor(max_workers=concurrency or crawl_concurrency) as executor:
+        pending = {}
+
+        def record(folder_item, children):
+            add_folder_to_state(crawl_state, folder_item)
+            crawl_state["folders"][folder_item["href"]]["children"] = children
+            for child in children:
+                if child["type"] != "FOLDER":
+                    continue
+                if reuse_folder is not None and reuse_folder(child):
+                    continue
+                pending[executor.submit(list_folder, child["href"])] = child
+
+        record(folder_item, children)
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    child = pending.pop(future)
+                    _, grandchildren = future.result()
+                    requests_made += 1
+                    record(child, grandchildren)
+        except Exception:
+            for future in pending:
+                future.cancel()
+            raise
+    return requests_made
+
+def retrieve_webdav_tree_incremental():
+    """
+    Retrieve the WebDAV tree, re-listing (Depth: 1) only the collections whose
+    getetag/getlastmodified changed since the previous run and reusing the cached
+    listing for every unchanged subtree.
+    Falls back to a full retrieve_webdav_tree when there is no previous crawl state,
+    the server does not report etags, or it does not propagate etag changes to parent
+    collections (see server_propagates_etags).
+    """
+    previous_state = load_crawl_state()
+    if previous_state.get("root") is None:
+        print("No previous crawl state, performing a full crawl")
+        return retrieve_webdav_tree()
+
+    crawl_state = new_crawl_state()
+    root_href = previous_state["root"]["href"]
+    root_item, root_children = list_collection(root_href)
+    if root_item is None or not root_item.get("etag"):
+        print("Server does not report collection etags, performing a full crawl")
+        return retrieve_webdav_tree()
+    if not server_propagates_etags(root_href):
+        print("Server does not propagate etags to parent collections, performing a full crawl")
+        return retrieve_webdav_tree()
+    crawl_state["root"] = root_item
+
+    def reuse_folder(child):
+        previous_folder = previous_state["folders"].get(child["href"])
+        if folder_unchanged(previous_folder, child):
+            copy_cached_subtree(child["href"], previous_state, crawl_state)
+            return True
+        return False
+
+    requests_made = 1 + walk_collections(root_item, root_children, crawl_state, reuse_folder)
+    print(f"Incremental crawl finished with {requests_made} PROPFIND request(s)")
+
+    tree_list = build_nested_tree(iter_crawl_state_items(crawl_state))
+    save_crawl_state(crawl_state)
+    return finalize_tree(tree_list)
+
+# --- Delta Sync (RFC 6578 sync-collection) ---
+
+sync_token_body = '''<?xml version="1.0" encoding="utf-8" ?>
+<propfind xmlns="DAV:">
+  <prop>
+    <sync-token/>
+  </prop>
+</propfind>'''
+
+sync_collection_body = '''<?xml version="1.0" encoding="utf-8" ?>
+<sync-collection xmlns="DAV:">
+  <sync-token>{token}</sync-token>
+  <sync-level>infinite</sync-level>
+  <prop>
+    <displayname/>
+    <getlastmodified/>
+    <getcontentlength/>
+    <getetag/>
+    <resourcetype/>
+  </prop>
+</sync-collection>'''
+
+# Maximum number of follow-up REPORTs when the server truncates the change set (507 on the collection).
+MAX_SYNC_COLLECTION_ROUNDS = 20
+
+def load_sync_token():
+    return get_store().get_state("sync_token")
+
+def save_sync_token(sync_token):
+    get_store().set_state("sync_token", sync_token)
+
+def fetch_sync_token():
+    """Return the current DAV:sync-token of the library collection, or None if the server has none."""
+    try:
+        response = get_session().request(
+            'PROPFIND',
+            webdav_url,
+            headers={'Depth': '0', 'Content-Type': 'text/xml'},
+            data=sync_token_body,
+            timeout=60
+        )
+    except requests.RequestException as e:
+        print(f"Could not fetch sync token: {e}")
+        return None
+    if response.status_code != 207:
+        return None
+    root_elem = ET.fromstring(response.content)
+    for token_elem in root_elem.iter(f'{DAV_NS}sync-token'):
+        if token_elem.text:
+            return token_elem.text.strip()
+    return None
+
+def parse_sync_collection(content):
+    """
+    Parse a sync-collection multistatus body.
+    Returns (changed items, removed hrefs, new sync token, truncated flag).
+    """
+    root_elem = ET.fromstring(content)
+    changed = []
+    removed = []
+    truncated = False
+    for resp in root_elem.findall(f'{DAV_NS}response'):
+        status_elem = resp.find(f'{DAV_NS}status')
+        if status_elem is not None and status_elem.text:
+            if ' 404' in status_elem.text:
+                href_elem = resp.find(f'{DAV_NS}href')
+                if href_elem is not None:
+                    removed.append(href_elem.text)
+            elif ' 507' in status_elem.text:
+                truncated = True
+            continue
+        item = parse_propfind_response(resp)
+        if item is not None:
+            changed.append(item)
+    token_elem = root_elem.find(f'{DAV_NS}sync-token')
+    new_token = token_elem.text.strip() if (token_elem is not None and token_elem.text) else None
+    return changed, removed, new_token, truncated
+
+def request_sync_collection(token):
+    """
+    Ask the server for all changes since token.
+    Returns (changed items, removed hrefs, new token), or None if the token expired,
+    the server does not support sync-collection or the request failed.
+    """
+    changed = []
+    removed = []
+    for _ in range(MAX_SYNC_COLLECTION_ROUNDS):
+        try:
+            response = get_session().request(
+                'REPORT',
+                webdav_url,
+                headers={'Depth': '0', 'Content-Type': 'text/xml', 'Accept-Encoding': 'gzip'},
+                data=sync_collection_body.format(token=escape(token)),
+                timeout=60
+            )
+        except requests.RequestException as e:
+            print(f"sync-collection REPORT failed ({e}), performing a crawl")
+            return None
+        if response.status_code != 207:
+            if 'valid-sync-token' in response.text:
+                print("Sync token expired, performing a crawl")
+            else:
+                print(f"sync-collection REPORT not supported (status {response.status_code}), performing a crawl")
+            return None
+        round_changed, round_removed, new_token, truncated = parse_sync_collection(response.content)
+        changed.extend(round_changed)
+        removed.extend(round_removed)
+        if new_token is None:
+            return None
+        token = new_token
+        if not truncated:
+            return changed, removed, token
+    print("sync-collection change set still truncated, performing a crawl")
+    return None
+
+def apply_sync_changes(crawl_state, changed, removed):
+    """
+    Apply a sync-collection delta to the crawl state.
+    Returns False if the delta references a folder the crawl state does not know,
+    in which case the state can no longer be trusted and a crawl is needed.
+    """
+    folders = crawl_state["folders"]
+    for href in removed:
+        parent = folders.get(parent_href(href))
+        if parent is not None:
+            parent["children"] = [child for child in parent["children"] if not same_href(child["href"], href)]
+        # Removed members carry no resourcetype, so check whether a known folder went away.
+        folder_prefix = href.rstrip('/') + '/'
+        if folder_prefix in folders:
+            for folder_href in [h for h in folders if h.startswith(folder_prefix)]:
+                del folders[folder_href]
+
+    # Apply parents before their children.
+    for item in sorted(changed, key=lambda i: i["href"].rstrip('/').count('/')):
+        href = item["href"]
+        root_href = crawl_state["root"]["href"]
+        if same_href(href, root_href):
+            crawl_state["root"] = {**item, "href": root_href}
+            if root_href in folders:
+                folders[root_href].update(etag=item.get("etag", ''), last_modified=item["last_modified"])
+            continue
+        parent = folders.get(parent_href(href))
+        if parent is None:
+            print(f"sync-collection reported {href} inside an unknown folder")
+            return False
+        parent["children"] = [child for child in parent["children"] if not same_href(child["href"], href)]
+        parent["children"].append(item)
+        if item["type"] == "FOLDER":
+            if href in folders:
+                folders[href].update(etag=item.get("etag", ''), last_modified=item["last_modified"])
+            else:
+                add_folder_to_state(crawl_state, item)
+    return True
+
+def sync_webdav_tree():
+    """
+    Bring the WebDAV tree up to date as cheaply as possible.
+    When a sync token from the previous run is available, a single sync-collection
+    REPORT returns only the members added, changed or removed since then and the delta
+    is applied to the saved crawl state. Otherwise (no token, token expired or no server
+    support) the library is crawled with retrieve_webdav_tree_incremental.
+    """
+    token = load_sync_token()
+    crawl_state = load_crawl_state()
+    if token and crawl_state.get("root") is not None:
+        delta = request_sync_collection(token)
+        if delta is not None:
+            changed, removed, new_token = delta
+            if apply_sync_changes(crawl_state, changed, removed):
+                print(f"Delta sync applied: {len(changed)} changed, {len(removed)} removed")
+                tree_list = build_nested_tree(iter_crawl_state_items(crawl_state))
+                save_crawl_state(crawl_state)
+                save_sync_token(new_token)
+                return finalize_tree(tree_list)
+
+    # Take the token before crawling so changes made during the crawl show up in the next delta.
+    token = fetch_sync_token()
+    tree = retrieve_webdav_tree_incremental()
+    save_sync_token(token)
+    return tree
+
+# --- Library Backends ---
+
+class LibraryBackend:
+    """
+    A source of library items. crawl() returns a finalized nested tree (the same shape
+    retrieve_webdav_tree returns) and watch() may report live changes.
+    """
+    def crawl(self):
+        raise NotImplementedError
+
+    def current_tree(self):
+        """Return the tree as currently known, crawling only if nothing is known yet."""
+        return self.crawl()
+
+    def owns_path(self, path):
+        raise NotImplementedError
+
+    def local_file_path(self, path):
+        """Return the filesystem path of a node for local backends, None for remote ones."""
+        return None
+
+    def watch(self, on_change):
+        """Start watching for changes and call on_change(backend) when the tree changed."""
+        pass
+
+    def stop(self):
+        pass
+
+class WebDAVLibraryBackend(LibraryBackend):
+    """The WebDAV share at WEBDAV_URL, synced with sync_webdav_tree."""
+    def crawl(self):
+        return sync_webdav_tree()
+
+    def owns_path(self, path):
+        # Everything not claimed by a local backend lives on the WebDAV share.
+        return True
+
+def get_library_backends():
+    """Return the WebDAV backend plus one local backend per entry in LOCAL_LIBRARY_PATHS."""
+    backends = [WebDAVLibraryBackend()]
+    local_paths = [p for p in os.getenv('LOCAL_LIBRARY_PATHS', '').split(os.pathsep) if p.strip()]
+    if local_paths:
+        from local_library import LocalLibraryBackend
+        backends = [LocalLibraryBackend(p.strip()) for p in local_paths] + backends
+    return backends
+
+def find_library_backend(path, backends):
+    """Return the first backend that owns a node path (local backends are checked before WebDAV)."""
+    for backend in backends:
+        if backend.owns_path(path):
+            return backend
+    return backends[-1]
+
+def sweep_unreferenced_posters(store=None):
+    """
+    Delete poster files (and thumbnail variants) that no catalog node or OMDb title record
+    references anymore. The store counts references per file as rows are written, so
+    this only looks at files whose references were dropped since the last sweep.
+
     Returns:
         int: Number of poster files deleted
     """
-    # Extract all file paths from current tree
-    current_paths = set()
-    
-    def collect_paths(node):
-        if node.get("type") != "FOLDER":
-            current_paths.add(node.get("path"))
-        for child in node.get("children", []):
-            collect_paths(child)
-    
-    for node in current_tree:
-        collect_paths(node)
-    
-    # Collect items from previous tree that had posters
-    previous_items = []
-    
-    def collect_items_with_posters(node):
-        if node.get("type") != "FOLDER" and node.get("poster_filename"):
-            previous_items.append({
-                "path": node.get("path"),
-                "poster_filename": node.get("poster_filename"),
-                "file_name": node.get("name")
-            })
-        for child in node.get("children", []):
-            collect_items_with_posters(child)
-    
-    for node in previous_tree:
-        collect_items_with_posters(node)
-    
-    # Find and delete orphaned posters
     deleted_count = 0
-    for item in previous_items:
-        if item["path"] not in current_paths:
-            # This item was deleted and had a poster file
-            poster_path = os.path.join(posters_dir, item["poster_filename"])
-            if os.path.exists(poster_path):
-                try:
-                    os.remove(poster_path)
-                    print(f"Deleted orphaned poster: {item['poster_filename']}")
-                    deleted_count += 1
-                    
-                    # Also clean up the db_cache entry
-                    if item["file_name"] in db_cache:
-                        del db_cache[item["file_name"]]
-                        
-                except OSError as e:
-                    print(f"Error deleting poster {item['poster_filename']}: {e}")
-    
+    for filename in (store or get_store()).take_unreferenced_posters():
+        poster_path = os.path.join(posters_dir, filename)
+        if os.path.basename(filename) != filename or not os.path.exists(poster_path):
+            continue
+        try:
+            os.remove(poster_path)
+            print(f"Deleted unreferenced poster: {filename}")
+            deleted_count += 1
+        except OSError as e:
+            print(f"Error deleting poster {filename}: {e}")
     return deleted_count
 
 # --- OMDb Integration Functions (for files only) ---
 
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per second with bursts of up to `capacity`."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+omdb_rate_limiter = TokenBucket(omdb_rate_limit)
+
+def get_omdb_session():
+    """Return a per-thread requests session (without WebDAV auth) for OMDb and poster requests."""
+    session = getattr(_thread_local, "omdb_session", None)
+    if session is None:
+        session = requests.Session()
+        _thread_local.omdb_session = session
+    return session
+
+def poster_url(filename, content_hash=None):
+    """
+    Public URL of a poster file. Thumbnail variants carry their content hash in the name;
+    full-size posters get it as ?v= so every URL can be cached as immutable.
+    """
+    url = f"{public_base_url}/posters/{filename}"
+    if content_hash and not posters.is_content_hashed(filename):
+        url += f"?v={content_hash}"
+    return url
+
+def create_poster_variants(poster_filename, source_path=None):
+    """Generate the thumbnail/WebP variants of a downloaded poster (read from source_path if given); returns None on failure."""
+    try:
+        return posters.create_poster_variants(source_path or os.path.join(posters_dir, poster_filename), posters_dir)
+    except Exception as e:
+        print(f"Error creating poster variants for {poster_filename}: {e}")
+        return None
+
+def poster_variant_urls(variants):
+    """Turn poster variant file names into the {"width", "jpg", "webp"} URLs exposed on catalog nodes."""
+    if not variants:
+        return None
+    return [{"width": v["width"], "jpg": poster_url(v["jpg"]), "webp": poster_url(v["webp"])} for v in variants]
+
 def get_poster_filename(title):
     # Generate an MD5 hash of the title and take the first 20 characters
     hash_digest = hashlib.md5(title.encode("utf-8")).hexdigest()[:20]
     return f"{hash_digest}.jpg"
 
 
+def omdb_query_key(title, year):
+    """Normalized (title, year) key of an OMDb lookup."""
+    return f"{' '.join(str(title).lower().split())}|{year or ''}"
+
+def new_db_cache():
+    """
+    The OMDb cache has two layers: "titles" maps each normalized (title, year) query to
+    the OMDb record, "files" maps each file name to its last_modified and the query it uses.
+    """
+    return {"files": {}, "titles": {}}
+
 def load_db_cache():
-    db_path = os.path.join(os.getcwd(), "db_cache.json")
-    if os.path.exists(db_path):
-        with open(db_path, "r") as f:
-            return json.load(f)
-    else:
-        return {}
+    """Load the OMDb cache from the metadata store (see metadata_store.py)."""
+    return get_store().load_db_cache()
+
+def migrate_db_cache(legacy_db):
+    """Convert a legacy per-file cache (file name -> full OMDb record) into the two-layer cache."""
+    db = new_db_cache()
+    for file_name, record in legacy_db.items():
+        query = omdb_query_key(record.get("title"), record.get("year"))
+        db["titles"].setdefault(query, {k: v for k, v in record.items() if k not in ("file_name", "last_modified")})
+        db["files"][file_name] = file_reference(file_name, record.get("title"), record.get("year"), record.get("last_modified"), query)
+    print(f"Migrated {len(db['files'])} db_cache entries into {len(db['titles'])} title records")
+    return db
 
 def save_db_cache(db):
-    db_path = os.path.join(os.getcwd(), "db_cache.json")
-    with open(db_path, "w") as f:
-        json.dump(db, f, indent=4)
+    get_store().save_db_cache(db)
 
 def convert_runtime(runtime_str):
     if runtime_str and runtime_str.endswith(" min"):
@@ -299,16 +1023,43 @@ def convert_votes(votes_int):
     else:
         return str(votes_int)
 
-def get_movie_details(request, title, year, file_name, last_modified, db_cache):
-    # If the item is in the cache and its last_modified hasn't changed, return the cached record.
-    if file_name in db_cache:
-        cached = db_cache[file_name]
-        if cached.get("last_modified") == last_modified:
-            return cached
+def file_reference(file_name, title, year, last_modified, query):
+    return {
+        "file_name": file_name,
+        "title": title,
+        "year": year,
+        "last_modified": last_modified,  # Save the current last_modified timestamp.
+        "query": query
+    }
+
+def get_cached_movie_details(file_name, last_modified, db_cache):
+    """Return the merged file + title record if the file is cached and its last_modified hasn't changed."""
+    cached = db_cache["files"].get(file_name)
+    if cached and cached.get("last_modified") == last_modified:
+        title_record = db_cache["titles"].get(cached.get("query"))
+        if title_record is not None:
+            return {**title_record, "file_name": file_name, "last_modified": last_modified}
+    return None
+
+def get_movie_details(request, title, year, file_name, last_modified, db_cache, refresh=True):
+    """
+    Return the OMDb details for a file. Unchanged files are answered from the file layer;
+    other files reference the title layer, which only queries OMDb when the title record is
+    missing (or refresh is set, for changed files whose query was not fetched in this sync).
+    """
+    cached = get_cached_movie_details(file_name, last_modified, db_cache)
+    if cached is not None:
+        return cached
+
+    query = omdb_query_key(title, year)
+    if refresh or query not in db_cache["titles"]:
+        db_cache["titles"][query] = fetch_title_record(request, title, year)
+    db_cache["files"][file_name] = file_reference(file_name, title, year, last_modified, query)
+    return get_cached_movie_details(file_name, last_modified, db_cache)
 
-    # Otherwise, build a new record.
+def fetch_title_record(request, title, year):
+    """Query OMDb for a (title, year) and download its poster."""
     record = {
-        "file_name": file_name,
         "title": title,
         "year": year,
         "poster": None,
@@ -326,13 +1077,14 @@ def get_movie_details(request, title, year, file_name, last_modified, db_cache):
         "boxOffice": None,
         "type": None,
         "omdb_title": None,
-        "last_modified": last_modified  # Save the current last_modified timestamp.
+        "poster_variants": None
     }
     params = {"apikey": omdb_api_key, "t": title, "plot": "full"}
     if year:
         params["y"] = year
     try:
-        response = requests.get("http://www.omdbapi.com/", params=params)
+        omdb_rate_limiter.acquire()
+        response = get_omdb_session().get("http://www.omdbapi.com/", params=params, timeout=30)
         if response.status_code == 200:
             data = response.json()
             if data.get("Response") == "True":
@@ -364,42 +1116,36 @@ def get_movie_details(request, title, year, file_name, last_modified, db_cache):
                         record["imdbVotes"] = votes_str
                 record["boxOffice"] = data.get("BoxOffice")
                 record["type"] = data.get("Type")
-                poster_url = data.get("Poster")
-                if poster_url and poster_url != "N/A":
+                omdb_poster_url = data.get("Poster")
+                if omdb_poster_url and omdb_poster_url != "N/A":
                     poster_filename = get_poster_filename(title)
                     poster_filepath = os.path.join(posters_dir, poster_filename)
-                    img_response = requests.get(poster_url, stream=True)
+                    img_response = get_omdb_session().get(omdb_poster_url, stream=True, timeout=30)
                     if img_response.status_code == 200:
-                        with open(poster_filepath, "wb") as f:
-                            for chunk in img_response.iter_content(1024):
-                                f.write(chunk)
+                        # Concurrent lookups of the same title share this file name: download to a
+                        # private temp file, derive hash and variants from it, then rename it into place
+                        temp_path = f"{poster_filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+                        try:
+                            with open(temp_path, "wb") as f:
+                                for chunk in img_response.iter_content(64 * 1024):
+                                    f.write(chunk)
+                            record["poster_hash"] = posters.content_hash(temp_path)
+                            record["poster_variants"] = create_poster_variants(poster_filename, temp_path)
+                            os.replace(temp_path, poster_filepath)
+                        finally:
+                            if os.path.exists(temp_path):
+                                os.remove(temp_path)
                         record["poster_filename"] = poster_filename
-                        record["poster"] = str(request.url_for("posters", path=poster_filename))
+                        record["poster"] = poster_url(poster_filename, record["poster_hash"])
                     else:
                         # Poster download failed, but if poster_filename is set, still set poster URL
                         if poster_filename:
                             record["poster_filename"] = poster_filename
-                            record["poster"] = str(request.url_for("posters", path=poster_filename))
+                            record["poster"] = poster_url(poster_filename)
     except Exception as e:
         print(f"Error querying OMDb API for {title}: {e}")
-    db_cache[file_name] = record
     return record
 
-# --- New Tree Cache Functions for last_modified timestamps ---
-
-def load_tree_cache():
-    tree_cache_path = os.path.join(os.getcwd(), "tree_cache.json")
-    if os.path.exists(tree_cache_path):
-        with open(tree_cache_path, "r") as f:
-            return json.load(f)
-    else:
-        return {}
-
-def save_tree_cache(tree_cache):
-    tree_cache_path = os.path.join(os.getcwd(), "tree_cache.json")
-    with open(tree_cache_path, "w") as f:
-        json.dump(tree_cache, f, indent=4)
-
 # --- Updated update_tree_with_omdb Function with Tree Caching ---
 def update_tree_with_omdb(node, request, db_cache, tree_cache=None):
     """
@@ -419,10 +1165,11 @@ def update_tree_with_omdb(node, request, db_cache, tree_cache=None):
         title = node.get("title")
         year = node.get("year")
         if title:
-            details = get_movie_details(request, title, year, node["name"], node["last_modified"], db_cache)
+            details = get_movie_details(request, title, year, node["name"], node["last_modified"], db_cache, refresh=False)
             node["poster"] = details.get("poster")
             node["api_found"] = details.get("api_found")
             node["poster_filename"] = details.get("poster_filename")
+            node["poster_variants"] = poster_variant_urls(details.get("poster_variants"))
             node["imdb"] = details.get("imdb")
             if node.get("season") is not None and node.get("episode") is not None:
                 node.pop("duration", None)
@@ -461,31 +1208,117 @@ def update_tree_with_omdb(node, request, db_cache, tree_cache=None):
     tree_cache[node["path"]] = node
     return node
 
+def collect_omdb_lookups(node, db_cache, tree_cache, lookups):
+    """Collect the distinct (title, year) queries of file nodes whose OMDb details are not cached yet."""
+    cached_node = tree_cache.get(node["path"])
+    if cached_node and cached_node.get("last_modified") == node.get("last_modified"):
+        return
+    if node["type"] != "FOLDER":
+        title = node.get("title")
+        if not title:
+            return
+        if get_cached_movie_details(node["name"], node["last_modified"], db_cache) is not None:
+            return
+        lookups.setdefault(omdb_query_key(title, node.get("year")), (title, node.get("year")))
+    else:
+        for child in node.get("children", []):
+            collect_omdb_lookups(child, db_cache, tree_cache, lookups)
+
+def fetch_title_into_cache(request, query, title, year, db_cache):
+    db_cache["titles"][query] = fetch_title_record(request, title, year)
+
+def enrich_tree_with_omdb(tree, request, db_cache, tree_cache=None, concurrency=None, progress=None):
+    """
+    Update every node of the tree with OMDb info in three phases: collect the distinct
+    (title, year) queries of files that are not cached, fetch each query once concurrently
+    through a bounded worker pool (OMDb requests go through omdb_rate_limiter), then write
+    the results back into the tree with update_tree_with_omdb, which only hits the cache.
+    progress(done, total) is called as lookups finish; if it raises, pending lookups are
+    cancelled and the exception propagates.
+    """
+    if tree_cache is None:
+        tree_cache = {}
+
+    lookups = {}
+    for node in tree:
+        collect_omdb_lookups(node, db_cache, tree_cache, lookups)
+
+    if lookups:
+        print(f"Fetching OMDb details for {len(lookups)} title(s)")
+        with ThreadPoolExecutor(max_workers=concurrency or omdb_concurrency) as executor:
+            futures = [
+                executor.submit(fetch_title_into_cache, request, query, title, year, db_cache)
+                for query, (title, year) in lookups.items()
+            ]
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    future.result()
+                    if progress:
+                        progress(done, len(futures))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    return [update_tree_with_omdb(node, request, db_cache, tree_cache) for node in tree]
+
+def prune_db_cache(db_cache, tree):
+    """Drop file records for files no longer in the tree and title records no longer referenced."""
+    file_names = set()
+
+    def collect_file_names(node):
+        if node.get("type") != "FOLDER":
+            file_names.add(node.get("name"))
+        for child in node.get("children", []):
+            collect_file_names(child)
+
+    for node in tree:
+        collect_file_names(node)
+    db_cache["files"] = {name: ref for name, ref in db_cache["files"].items() if name in file_names}
+    queries = {ref.get("query") for ref in db_cache["files"].values()}
+    db_cache["titles"] = {query: record for query, record in db_cache["titles"].items() if query in queries}
+
 # --- Poster Fix Utilities ---
 
+def build_missing_poster_variants(db):
+    """Create thumbnail variants for cached title records whose poster predates the poster pipeline."""
+    for entry in db["titles"].values():
+        poster_filename = entry.get("poster_filename")
+        if poster_filename and not entry.get("poster_variants") and os.path.exists(os.path.join(posters_dir, poster_filename)):
+            entry["poster_variants"] = create_poster_variants(poster_filename)
+
 def fix_db_cache_posters(db):
     """
-    For each entry in the db_cache dict, if 'poster' is null/missing and 'poster_filename' is set,
-    set 'poster' to the correct URL.
+    For each title record in the db_cache dict with a 'poster_filename', set 'poster' to the
+    content-hashed URL (hashing the file once if the record predates poster hashes).
     """
-    for entry in db.values():
-        if (not entry.get("poster")) and entry.get("poster_filename"):
-            entry["poster"] = f"http://127.0.0.1:50005/posters/{entry['poster_filename']}"
+    for entry in db["titles"].values():
+        poster_filename = entry.get("poster_filename")
+        if not poster_filename:
+            continue
+        poster_path = os.path.join(posters_dir, poster_filename)
+        if not entry.get("poster_hash") and os.path.exists(poster_path):
+            entry["poster_hash"] = posters.content_hash(poster_path)
+        entry["poster"] = poster_url(poster_filename, entry.get("poster_hash"))
 
-def fix_tree_posters(node, inherited_poster=None):
+def fix_tree_posters(node, inherited_poster=None, inherited_variants=None):
     """
     Recursively fix poster inheritance in a tree node.
     - If 'poster' is null/missing and 'poster_filename' is set, set 'poster' to the correct URL.
-    - If 'poster' is still null/missing and inherited_poster is set, inherit it.
+    - If 'poster' is still null/missing and inherited_poster is set, inherit it (with its size variants).
     - Recurse into children.
     """
     # Set poster from poster_filename if possible
     if (not node.get("poster")) and node.get("poster_filename"):
-        node["poster"] = f"http://127.0.0.1:50005/posters/{node['poster_filename']}"
+        node["poster"] = poster_url(node["poster_filename"])
     # Inherit poster if still missing
     if not node.get("poster") and inherited_poster:
         node["poster"] = inherited_poster
+        node["poster_variants"] = inherited_variants
     # Pass down the nearest non-null poster
-    next_inherited = node.get("poster") or inherited_poster
+    if node.get("poster"):
+        next_inherited, next_variants = node["poster"], node.get("poster_variants")
+    else:
+        next_inherited, next_variants = inherited_poster, inherited_variants
     for child in node.get("children", []):
-        fix_tree_posters(child, next_inherited)
+        fix_tree_posters(child, next_inherited, next_variants)
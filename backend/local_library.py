@@ -0,0 +1,187 @@
+import os
+import threading
+from email.utils import formatdate
+from pathlib import Path
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+import crawler
+
+# Maximum number of directories scanned concurrently.
+local_scan_concurrency = max(1, int(os.getenv('LOCAL_SCAN_CONCURRENCY', '8')))
+# Seconds to wait for more filesystem events before rescanning and notifying.
+WATCH_DEBOUNCE_SECONDS = 1.0
+
+def to_href(path, is_dir):
+    """Local node paths use forward slashes, with a trailing slash for folders (like WebDAV hrefs)."""
+    href = Path(path).as_posix()
+    if is_dir and not href.endswith('/'):
+        href += '/'
+    return href
+
+def entry_item(path, stat_result, is_dir):
+    """Build a flat item (same keys as crawler.parse_propfind_response) for a local path."""
+    name = os.path.basename(os.path.normpath(path))
+    return {
+        "href": to_href(path, is_dir),
+        "name": name,
+        # Same RFC 1123 format WebDAV servers use for getlastmodified.
+        "last_modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "type": "FOLDER" if is_dir else crawler.determine_file_type(name),
+        "size": 0 if is_dir else stat_result.st_size,
+        "etag": ''
+    }
+
+def scan_directory(href):
+    """List a single directory with os.scandir; returns (own item, child items) like crawler.list_collection."""
+    path = href.rstrip('/') or '/'
+    own_item = entry_item(path, os.stat(path), True)
+    children = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+                children.append(entry_item(entry.path, entry.stat(), is_dir))
+            except OSError as e:
+                print(f"Skipping {entry.path}: {e}")
+    children.sort(key=lambda item: item["name"])
+    return own_item, children
+
+class LibraryEventHandler(FileSystemEventHandler):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed", "closed_no_write"):
+            return
+        if event.is_directory and event.event_type == "modified":
+            # Directory mtime changes are covered by the events on their entries.
+            return
+        paths = [event.src_path]
+        if getattr(event, "dest_path", None):
+            paths.append(event.dest_path)
+        for path in paths:
+            self.backend.schedule_rescan(to_href(os.path.dirname(path), True))
+
+class LocalLibraryBackend(crawler.LibraryBackend):
+    """
+    A library folder on a local or mounted filesystem. It is crawled with os.scandir
+    across parallel directory workers and kept up to date through filesystem events
+    (inotify on Linux), rescanning only the directories that changed.
+    """
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.root_href = to_href(self.root, True)
+        self.crawl_state = crawler.new_crawl_state()
+        self._lock = threading.Lock()
+        self._pending_dirs = set()
+        self._timer = None
+        self._observer = None
+        self._on_change = None
+
+    def crawl(self):
+        crawl_state = crawler.new_crawl_state()
+        root_item, root_children = scan_directory(self.root_href)
+        crawl_state["root"] = root_item
+        crawler.walk_collections(root_item, root_children, crawl_state,
+                                 concurrency=local_scan_concurrency, list_folder=scan_directory)
+        with self._lock:
+            self.crawl_state = crawl_state
+            return self._build_tree()
+
+    def current_tree(self):
+        with self._lock:
+            if self.crawl_state["root"] is not None:
+                return self._build_tree()
+        return self.crawl()
+
+    def _build_tree(self):
+        return crawler.finalize_tree(crawler.build_nested_tree(crawler.iter_crawl_state_items(self.crawl_state)))
+
+    def _resolve(self, path):
+        """Real filesystem path of a node path, or None if it resolves outside the library root."""
+        if not path:
+            return None
+        real_path = os.path.realpath(path)
+        try:
+            if os.path.commonpath([real_path, self.root]) != self.root:
+                return None
+        except ValueError:
+            # Paths on different drives (Windows)
+            return None
+        return real_path
+
+    def owns_path(self, path):
+        return self._resolve(path) is not None
+
+    def local_file_path(self, path):
+        real_path = self._resolve(path)
+        if real_path is None:
+            raise ValueError(f"{path} is outside the library folder {self.root}")
+        return real_path
+
+    # --- Live updates ---
+
+    def watch(self, on_change):
+        self._on_change = on_change
+        self._observer = Observer()
+        self._observer.schedule(LibraryEventHandler(self), self.root, recursive=True)
+        self._observer.daemon = True
+        self._observer.start()
+        print(f"Watching local library {self.root} for changes")
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def schedule_rescan(self, dir_href):
+        with self._lock:
+            self._pending_dirs.add(dir_href)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(WATCH_DEBOUNCE_SECONDS, self._flush_rescans)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_rescans(self):
+        with self._lock:
+            dirs = self._pending_dirs
+            self._pending_dirs = set()
+            self._timer = None
+            if self.crawl_state["root"] is None:
+                # Nothing crawled yet; the next current_tree() does a full crawl anyway.
+                dirs = set()
+            for dir_href in sorted(dirs, key=len):
+                try:
+                    self._rescan_directory(dir_href)
+                except OSError as e:
+                    print(f"Error rescanning {dir_href}: {e}")
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def _rescan_directory(self, dir_href):
+        """Re-list one directory, dropping removed subfolders and crawling new ones."""
+        folders = self.crawl_state["folders"]
+        # Walk up to the closest directory that still exists and is known.
+        while dir_href != self.root_href and (dir_href not in folders or not os.path.isdir(dir_href.rstrip('/'))):
+            dir_href = crawler.parent_href(dir_href)
+        own_item, children = scan_directory(dir_href)
+
+        previous = folders.get(dir_href, {"children": []})
+        current_folders = {child["href"] for child in children if child["type"] == "FOLDER"}
+        for child in previous["children"]:
+            if child["type"] == "FOLDER" and child["href"] not in current_folders:
+                for folder_href in [h for h in folders if h.startswith(child["href"])]:
+                    del folders[folder_href]
+
+        if dir_href == self.root_href:
+            self.crawl_state["root"] = own_item
+        crawler.add_folder_to_state(self.crawl_state, own_item)
+        folders[dir_href]["children"] = children
+        for child in children:
+            if child["type"] == "FOLDER" and child["href"] not in folders:
+                _, grandchildren = scan_directory(child["href"])
+                crawler.walk_collections(child, grandchildren, self.crawl_state,
+                                         concurrency=local_scan_concurrency, list_folder=scan_directory)
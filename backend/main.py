@@ -1,19 +1,23 @@
 import os
-import json
 import subprocess
 import threading
-import time
 import asyncio
+import mimetypes
 from fastapi import FastAPI, Request, Body, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import crawler
+import posters
+from metadata_store import get_store
+from catalog import Catalog
+from catalog_index import StaleCursorError
+from sync_jobs import SyncJobManager
 import base64
 from dotenv import load_dotenv
-from position_download import download_from_webdav
-from position_upload import get_latest_watch_later_file, upload_to_webdav
+from playback import PlaybackTracker, new_ipc_path
+from position_sync import get_position_sync
+from position_store import PositionStore, position_hash
 from urllib.parse import urlparse
 from datetime import datetime, timedelta
 
@@ -22,8 +26,10 @@ app = FastAPI()
 # Global event loop reference (set on startup)
 app_loop = None
 
-# Path for storing the last sync timestamp
-LAST_SYNC_FILE = os.path.join(os.getcwd(), "last_sync.json")
+# Catalog, OMDb cache and sync state live in the SQLite metadata store
+store = get_store()
+# Parsed catalog and sync state kept in memory for the read endpoints
+catalog = Catalog(store)
 CHECK_INTERVAL = 60 * 60  # Check every hour if sync is needed
 
 @app.on_event("startup")
@@ -34,6 +40,52 @@ async def startup_event():
     # Start the background sync task
     asyncio.create_task(periodic_sync_task())
 
+    # Fetch the watch positions of the catalog in the background
+    threading.Thread(target=sync_watch_positions, daemon=True).start()
+
+    # Watch local library backends for live changes
+    for backend in library_backends:
+        backend.watch(on_library_change)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for backend in library_backends:
+        backend.stop()
+    # Upload the positions that are still waiting out their debounce
+    for tracker in list(active_trackers.values()):
+        tracker.stop()
+    await asyncio.to_thread(get_position_sync().close)
+
+def on_library_change(backend):
+    """Called from a watcher thread when a library backend reports changes."""
+    if app_loop:
+        app_loop.call_soon_threadsafe(start_library_refresh, backend)
+
+def start_library_refresh(backend):
+    """Queue a refresh of one library backend; it runs in the sync worker, never alongside a sync."""
+    sync_jobs.start("filesystem", kind="refresh", key=f"refresh:{library_backends.index(backend)}", run=lambda job: refresh_library_backend(backend, job))
+
+def refresh_library_backend(backend, job):
+    """Replace the nodes of one library backend in the database with its current tree (blocking)."""
+    job.report("crawling", 5)
+    tree = backend.current_tree()
+    job.report("loading cache", 30)
+    db_cache = crawler.load_db_cache()
+    job.report("fetching OMDb details", 40)
+    crawler.enrich_tree_with_omdb(tree, None, db_cache, progress=lambda done, total: job.report("fetching OMDb details", 40 + 45 * done / total))
+    crawler.fix_db_cache_posters(db_cache)
+    for node in tree:
+        crawler.fix_tree_posters(node)
+
+    job.report("saving", 90)
+    crawler.save_db_cache(db_cache)
+    old_paths = [node["path"] for node in get_cached_movies() if crawler.find_library_backend(node.get("path", ""), library_backends) is backend]
+    store.replace_top_level_nodes(old_paths, tree)
+    catalog.invalidate()
+    rebuild_catalog()
+    print("Library updated from filesystem changes")
+    app_loop.call_soon_threadsafe(asyncio.create_task, manager.broadcast("library_updated"))
+
 async def periodic_sync_task():
     """Background task that runs periodically to check if a sync is needed."""
     print("Starting periodic sync background task")
@@ -42,14 +94,8 @@ async def periodic_sync_task():
             # Check if a weekly sync is needed
             if is_weekly_sync_needed():
                 print("Starting automatic weekly sync...")
-                # Create a dummy request for the sync function
-                class DummyRequest:
-                    def __init__(self):
-                        self.base_url = "http://localhost:50005"
-                
-                dummy_request = DummyRequest()
-                await perform_full_sync(dummy_request)
-                print("Automatic weekly sync completed")
+                job = await sync_jobs.wait(sync_jobs.start("weekly"))
+                print(f"Automatic weekly sync {job.status}")
             
             # Wait for the next check interval
             await asyncio.sleep(CHECK_INTERVAL)
@@ -59,18 +105,15 @@ async def periodic_sync_task():
 
 def is_weekly_sync_needed():
     """Check if it's been more than a week since the last sync."""
-    if not os.path.exists(LAST_SYNC_FILE):
+    last_sync = store.get_state("last_sync")
+    if not last_sync:
         return True
-        
+
     try:
-        with open(LAST_SYNC_FILE, "r") as f:
-            sync_data = json.load(f)
-            last_sync = datetime.fromisoformat(sync_data.get("last_sync"))
-            now = datetime.now()
-            # Return True if more than 7 days have passed
-            return (now - last_sync) > timedelta(days=7)
-    except (json.JSONDecodeError, ValueError, KeyError):
-        # If file is invalid or can't be parsed, sync is needed
+        # Return True if more than 7 days have passed
+        return (datetime.now() - datetime.fromisoformat(last_sync)) > timedelta(days=7)
+    except (TypeError, ValueError):
+        # If the timestamp can't be parsed, sync is needed
         return True
 
 # Load environment variables from .env file
@@ -87,6 +130,9 @@ def get_webdav_prefix(url):
 prefix = get_webdav_prefix(WEBDAV_URL)
 print(f"Using WebDAV prefix: {prefix}")
 
+# Library sources: local folders from LOCAL_LIBRARY_PATHS followed by the WebDAV share
+library_backends = crawler.get_library_backends()
+
 # Add CORS middleware to allow cross-origin requests from the frontend
 app.add_middleware(
     CORSMiddleware,
@@ -96,108 +142,131 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variable to track active uploads by video URL
-active_uploads = set()
+# Playback position trackers of running mpv processes by video URL
+active_trackers = {}
+
+# Local copies of the watch_later files, kept in sync with WebDAV in the background
+position_store = PositionStore(os.path.join(os.path.dirname(__file__), "portable_config", "watch_later"))
+
+def video_url_for(video_path):
+    """The path or URL mpv is started with for a catalog node (its watch_later file is named after it)."""
+    local_file = crawler.find_library_backend(video_path, library_backends).local_file_path(video_path)
+    if local_file:
+        # Files from a local library backend are played straight from disk
+        return local_file
+    video_path = video_path.lstrip("/")
+    if video_path.startswith(prefix):
+        video_path = video_path[len(prefix):]
+    return os.getenv("WEBDAV_URL_BASE") + prefix + video_path
+
+def sync_watch_positions():
+    """Prefetch the remote watch positions of catalog videos and drop local ones of removed videos."""
+    try:
+        # Read the paths straight from the store, so a cold start never parses the catalog for this
+        paths = store.file_paths()
+        # Without a catalog nothing is known to be removed: fetch everything, delete nothing
+        wanted = {position_hash(video_url_for(path)) for path in paths} if paths else None
+        busy = {position_hash(video_url) for video_url in list(active_trackers)}
+        downloaded, removed = position_store.sync(wanted, busy)
+        print(f"Watch positions synced: {downloaded} downloaded, {removed} removed")
+    except Exception as e:
+        print(f"Error syncing watch positions: {str(e)}")
 
 # Function to save the last sync timestamp
 def save_last_sync_time():
-    sync_data = {
-        "last_sync": datetime.now().isoformat()
-    }
-    with open(LAST_SYNC_FILE, "w") as f:
-        json.dump(sync_data, f)
+    store.set_state("last_sync", datetime.now().isoformat())
 
 # Function to check if sync is needed (more than 168 hours since last sync)
-def is_sync_needed():
-    if not os.path.exists(LAST_SYNC_FILE):
+def is_sync_needed(last_sync):
+    if not last_sync:
         return True
-        
+
     try:
-        with open(LAST_SYNC_FILE, "r") as f:
-            sync_data = json.load(f)
-            last_sync = datetime.fromisoformat(sync_data.get("last_sync"))
-            now = datetime.now()
-            # Return True if more than 168 hours have passed
-            return (now - last_sync) > timedelta(hours=168)
-    except (json.JSONDecodeError, ValueError, KeyError):
-        # If file is invalid or can't be parsed, sync is needed
+        # Return True if more than 168 hours have passed
+        return (datetime.now() - datetime.fromisoformat(last_sync)) > timedelta(hours=168)
+    except (TypeError, ValueError):
+        # If the timestamp can't be parsed, sync is needed
         return True
 
 # Function to get the cached movie data
 def get_cached_movies():
-    db_path = os.path.join(os.getcwd(), "database.json")
-    if os.path.exists(db_path):
-        try:
-            with open(db_path, "r") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return []
-    return []
+    if not catalog.is_fresh():
+        catalog.load()
+    return catalog.tree
 
-# Function to perform a full sync and update the database
-async def perform_full_sync(request):
-    try:
-        # Load the previous database state
-        db_path = os.path.join(os.getcwd(), "database.json")
-        previous_tree = []
-        if os.path.exists(db_path):
-            try:
-                with open(db_path, "r") as f:
-                    previous_tree = json.load(f)
-            except json.JSONDecodeError:
-                print("Warning: database.json is invalid, starting with empty previous tree")
-        
-        # Get the current WebDAV tree
-        tree = crawler.retrieve_webdav_tree()
-        
-        # Load database cache
-        db_cache = crawler.load_db_cache()
-        
-        # Clean up orphaned posters from deleted media files
-        deleted_count = crawler.cleanup_orphaned_posters(tree, previous_tree, db_cache)
-        if deleted_count > 0:
-            print(f"Deleted {deleted_count} orphaned poster files")
-            
-        # Update tree with OMDb info
-        for node in tree:
-            crawler.update_tree_with_omdb(node, request, db_cache)
-        
-        # Fix poster fields in db_cache before saving
-        crawler.fix_db_cache_posters(db_cache)
-        # Save updated database cache
-        crawler.save_db_cache(db_cache)
-        
-        # Fix poster inheritance in the tree before saving
-        for node in tree:
-            crawler.fix_tree_posters(node)
-        # Save the updated tree
-        with open(db_path, "w") as f:
-            json.dump(tree, f, indent=4)
-        
-        # Update the last sync time
-        save_last_sync_time()
-        
-        return tree
-    except Exception as e:
-        print(f"Error during sync: {str(e)}")
-        raise e
+def rebuild_catalog():
+    """Reload the catalog after a partial change and rewrite its snapshot file (blocking)."""
+    catalog.load()
+    catalog.build()
 
-# Function to periodically upload position files
-def upload_position_periodically(video_url):
-    print(f"Starting position upload thread for {video_url}")
-    try:
-        while video_url in active_uploads:
-            latest_file, error = get_latest_watch_later_file(max_age_seconds=30)
-            if error is None and latest_file is not None:
-                if upload_to_webdav(latest_file):
-                    print(f"Position file {latest_file.name} uploaded successfully")
-                else:
-                    print(f"Failed to upload position file {latest_file.name}")
-            time.sleep(10)
-    except Exception as e:
-        print(f"Error in upload thread: {str(e)}")
-    finally:
-        print(f"Position upload thread for {video_url} stopped")
+async def get_catalog():
+    """Return the in-memory catalog, reloading it off the event loop only when it is stale."""
+    if not catalog.is_fresh():
+        await asyncio.to_thread(catalog.load)
+    return catalog
+
+# Function to perform a full sync and update the database
+def perform_full_sync(job):
+    """
+    Crawl every library backend, enrich with OMDb and store the new catalog. Blocking:
+    runs in the sync job's worker thread, reporting progress and honouring cancellation
+    through the job until the results are written.
+    """
+    # Get the current tree of every library backend (for WebDAV a sync-collection delta
+    # or a crawl that re-lists only changed folders)
+    tree = []
+    for number, backend in enumerate(library_backends):
+        job.report("crawling", 5 + 25 * number / len(library_backends))
+        tree.extend(backend.crawl())
+    # Each backend adds its names to the guessit cache; drop the names no backend has anymore
+    crawler.prune_guessit_cache(tree)
+
+    # Load database cache
+    job.report("loading cache", 30)
+    db_cache = crawler.load_db_cache()
+
+    # Create thumbnails for posters downloaded before the poster pipeline existed
+    # and point cached records at content-hashed poster URLs
+    job.report("preparing posters", 35)
+    crawler.build_missing_poster_variants(db_cache)
+    crawler.fix_db_cache_posters(db_cache)
+
+    # Update tree with OMDb info
+    job.report("fetching OMDb details", 40)
+    crawler.enrich_tree_with_omdb(tree, None, db_cache, progress=lambda done, total: job.report("fetching OMDb details", 40 + 45 * done / total))
+    # Drop cache records of files that are gone and titles nothing references anymore
+    crawler.prune_db_cache(db_cache, tree)
+
+    # Fix poster fields in db_cache and poster inheritance in the tree before saving
+    crawler.fix_db_cache_posters(db_cache)
+    for node in tree:
+        crawler.fix_tree_posters(node)
+
+    # Last chance to cancel: from here on the results are written
+    job.report("saving", 90)
+
+    # Save updated database cache and the updated tree
+    crawler.save_db_cache(db_cache)
+    store.save_tree(tree)
+
+    # Delete poster files that lost their last reference with this sync or earlier deletes
+    deleted_count = crawler.sweep_unreferenced_posters(store)
+    if deleted_count > 0:
+        print(f"Deleted {deleted_count} unreferenced poster files")
+
+    # Update the last sync time
+    save_last_sync_time()
+
+    # Serve the new tree from memory and build its response bytes and query indexes now
+    catalog.replace(tree)
+    catalog.build()
+
+    # Fetch positions of new videos and drop those of removed ones
+    threading.Thread(target=sync_watch_positions, daemon=True).start()
+    return tree
+
+# Syncs run one at a time in a worker thread; progress is pushed to the websocket clients
+sync_jobs = SyncJobManager(perform_full_sync, lambda message: manager.broadcast(message))
 
 # Get WebDAV credentials from environment variables
 WEBDAV_USERNAME = os.getenv('WEBDAV_USERNAME')
@@ -207,35 +276,212 @@ WEBDAV_PASSWORD = os.getenv('WEBDAV_PASSWORD')
 async def health_check():
     return {"status": "ok"}
 
-# Serve posters using the posters_dir from crawler.py
-app.mount("/posters", StaticFiles(directory=crawler.posters_dir), name="posters")
+def etag_matches(request, etag):
+    """True when the request's If-None-Match header matches the given strong ETag."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or f'"{etag}"' in tags
+
+# Serve posters from the posters_dir of crawler.py through a bounded in-memory LRU
+POSTER_CACHE_BYTES = int(os.getenv("POSTER_CACHE_MB", "64")) * 1024 * 1024
+poster_cache = posters.PosterCache(crawler.posters_dir, POSTER_CACHE_BYTES)
+
+@app.get("/posters/{path}", name="posters")
+async def serve_poster(path: str, request: Request):
+    """
+    Serve a poster with a strong ETag. Content-hashed URLs (thumbnail variants, or
+    ?v=<hash> on full-size posters) are cacheable forever; others must revalidate.
+    """
+    if os.path.basename(path) != path or path.startswith("."):
+        return Response(status_code=404)
+    entry = await asyncio.to_thread(poster_cache.get, path)
+    if entry is None:
+        return Response(status_code=404)
+    etag, content = entry
+    immutable = request.query_params.get("v") == etag or posters.is_content_hashed(path)
+    headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": "public, max-age=31536000, immutable" if immutable else "no-cache"
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return Response(content=content, media_type=media_type, headers=headers)
 
 @app.get("/api/movies", response_class=JSONResponse)
 async def api_movies(request: Request):
+    """
+    Serve the catalog as JSON bytes that are encoded and compressed once per catalog
+    version. Clients revalidate with If-None-Match and get a 304 while nothing changed.
+    """
     try:
-        if is_sync_needed():
+        current = await get_catalog()
+        if is_sync_needed(current.last_sync):
             print("Performing full sync (automatic - over 168 hours)")
-            tree = await perform_full_sync(request)
-        else:
-            print("Using cached movie data (last sync within 168 hours)")
-            tree = get_cached_movies()
-            
-        return tree
+            job = sync_jobs.start("automatic")
+            # Keep serving the last good catalog; only the very first sync is waited for
+            if current.is_empty():
+                await sync_jobs.wait(job)
+
+        encoded = await asyncio.to_thread(catalog.encoded)
+        headers = {
+            "ETag": f'"{encoded.etag}"',
+            "X-Catalog-Version": str(catalog.version),
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding"
+        }
+        if etag_matches(request, encoded.etag):
+            return Response(status_code=304, headers=headers)
+        content_encoding, content = encoded.negotiate(request.headers.get("accept-encoding"))
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        return Response(content=content, media_type="application/json", headers=headers)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+def optional_number(request, name, cast):
+    value = request.query_params.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        raise ValueError(f"Invalid value for {name}: {value}")
+
+@app.get("/api/query", response_class=JSONResponse)
+async def api_query(request: Request):
+    """
+    Page through the catalog with filters (type, genre, language, year_min/max,
+    rating_min/max) and a sort (title, year, rating, size, last_modified; asc/desc).
+    Pass the returned next_cursor as ?cursor= to get the following page.
+    """
+    try:
+        params = request.query_params
+        filters = {
+            "type": params.get("type"),
+            "genre": params.get("genre"),
+            "language": params.get("language"),
+            "year_min": optional_number(request, "year_min", int),
+            "year_max": optional_number(request, "year_max", int),
+            "rating_min": optional_number(request, "rating_min", float),
+            "rating_max": optional_number(request, "rating_max", float)
+        }
+        limit = optional_number(request, "limit", int) or 50
+        await get_catalog()
+        index = await asyncio.to_thread(catalog.index)
+        return index.query(filters, params.get("sort", "title"), params.get("direction", "asc"), limit, params.get("cursor"))
+    except StaleCursorError as e:
+        return JSONResponse(status_code=409, content={"error": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/api/changes", response_class=JSONResponse)
+async def api_changes(request: Request):
+    """
+    Node-level changes (add/update/remove) since a catalog version. The current version
+    comes with every response and in the X-Catalog-Version header of /api/movies. When
+    the log no longer reaches back to ?since=, full_refresh tells the client to reload.
+    """
+    try:
+        since = optional_number(request, "since", int)
+        if since is None:
+            return {"version": await asyncio.to_thread(store.catalog_version), "changes": []}
+        version, changes = await asyncio.to_thread(store.changes_since, since)
+        if changes is None:
+            return {"version": version, "full_refresh": True}
+        return {"version": version, "full_refresh": False, "changes": changes}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/api/tree", response_class=JSONResponse)
+async def api_tree(request: Request):
+    """One folder (or the library root without ?path=) with its children down to ?depth= levels (default 1)."""
+    try:
+        depth = optional_number(request, "depth", int)
+        depth = 1 if depth is None else max(0, min(depth, 32))
+        await get_catalog()
+        node = await asyncio.to_thread(catalog.subtree, request.query_params.get("path"), depth)
+        if node is None:
+            return JSONResponse(status_code=404, content={"error": "Path not found"})
+        return node
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/api/item", response_class=JSONResponse)
+async def api_item(request: Request):
+    """A single catalog node by ?path=, without its children."""
+    try:
+        path = request.query_params.get("path")
+        if not path:
+            return JSONResponse(status_code=400, content={"error": "Missing path"})
+        await get_catalog()
+        node = await asyncio.to_thread(catalog.item, path)
+        if node is None:
+            return JSONResponse(status_code=404, content={"error": "Path not found"})
+        return node
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/api/search", response_class=JSONResponse)
+async def api_search(request: Request):
+    """
+    Ranked full-text search over titles, file names, plots, actors, directors and genres.
+    Every word must match; the words also match as prefixes (?prefix=false turns that off).
+    """
+    try:
+        query = request.query_params.get("q", "")
+        limit = max(1, min(optional_number(request, "limit", int) or 20, 200))
+        prefix_match = request.query_params.get("prefix", "true").lower() != "false"
+        await get_catalog()
+        index = await asyncio.to_thread(catalog.search_index)
+        results = await asyncio.to_thread(index.search, query, limit, prefix_match)
+        return {"query": query, "results": [dict(node, score=round(score, 3)) for score, node in results]}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.post("/api/sync", response_class=JSONResponse)
 async def manual_sync(request: Request):
+    """
+    Start a sync (or join the one already running). Waits for it to finish unless
+    ?wait=false is passed, in which case the job status is returned right away.
+    """
     try:
         print("Performing full sync (manual trigger)")
-        tree = await perform_full_sync(request)
-        return {"status": "success", "message": "Manual sync completed"}
+        job = sync_jobs.start("manual")
+        if request.query_params.get("wait", "true").lower() == "false":
+            return JSONResponse(status_code=202, content=job.to_dict())
+        job = await sync_jobs.wait(job)
+        if job.status == "succeeded":
+            return {"status": "success", "message": "Manual sync completed"}
+        if job.status == "cancelled":
+            return JSONResponse(status_code=409, content={"error": "Sync was cancelled"})
+        return JSONResponse(status_code=500, content={"error": job.error})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.get("/api/sync/status", response_class=JSONResponse)
+async def sync_status():
+    return sync_jobs.status()
+
+@app.post("/api/sync/cancel", response_class=JSONResponse)
+async def cancel_sync():
+    job = sync_jobs.cancel()
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "No sync is running"})
+    return job.to_dict()
+
 @app.post("/api/play", response_class=JSONResponse)
 async def play_video(request: Request, data: dict = Body(...)):
-    global active_uploads
     try:
         video_path = data.get("path")
         title = data.get("title", "Media Player")
@@ -248,15 +494,12 @@ async def play_video(request: Request, data: dict = Body(...)):
         config_dir_path = os.path.join(backend_dir, "portable_config")
 
         # Process video path
-        video_path = video_path.lstrip("/")
-        if video_path.startswith(prefix):
-            video_path = video_path[len(prefix):]
-        WEBDAV_URL_BASE = os.getenv("WEBDAV_URL_BASE")
-        video_url = WEBDAV_URL_BASE + prefix + video_path
+        video_url = video_url_for(video_path)
 
-        # Download position file (common)
+        # Always ask for the current position file (another device may have saved one);
+        # a prefetched copy that is still current only costs a 304
         print(f"Starting playback for: {video_url}")
-        position_found = download_from_webdav(video_url)
+        position_found = await asyncio.to_thread(position_store.fetch, video_url)
         if position_found:
             print(f"Watch position found and loaded for {title}")
         else:
@@ -272,6 +515,9 @@ async def play_video(request: Request, data: dict = Body(...)):
             formatted_auth = ""
             print("WARNING: No WebDAV credentials found in .env file")
 
+        # mpv reports playback events on this IPC server for position tracking
+        ipc_path = new_ipc_path()
+
         # --- OS-specific command building ---
         command_to_run = None
         shell_execute = False
@@ -291,7 +537,8 @@ async def play_video(request: Request, data: dict = Body(...)):
                 f'"{mpv_executable}"',
                 f'--config-dir="{config_dir_path}"',
                 '--force-window=yes',
-                '--fullscreen'
+                '--fullscreen',
+                f'--input-ipc-server="{ipc_path}"'
             ]
             if formatted_auth:
                 command_list.append(f'--http-header-fields="{formatted_auth}"')
@@ -323,7 +570,8 @@ async def play_video(request: Request, data: dict = Body(...)):
                 mpv_executable,
                 f'--config-dir={config_dir_path}',
                 '--force-window=yes',
-                '--fullscreen'
+                '--fullscreen',
+                f'--input-ipc-server={ipc_path}'
             ]
             if formatted_auth:
                 command_list.append(f'--http-header-fields={formatted_auth}')
@@ -344,23 +592,26 @@ async def play_video(request: Request, data: dict = Body(...)):
 
         print(f"Command string: {command_to_run}")
         
-        # Start upload thread (common)
-        active_uploads.add(video_url)
-        upload_thread = threading.Thread(
-            target=upload_position_periodically,
-            args=(video_url,),
-            daemon=True
-        )
-        upload_thread.start()
-        
         # Launch MPV
         process = subprocess.Popen(command_to_run, shell=shell_execute)
+
+        # Track the playback position over mpv's IPC socket (common)
+        previous_tracker = active_trackers.pop(video_url, None)
+        if previous_tracker:
+            previous_tracker.stop()
+        tracker = PlaybackTracker(ipc_path, video_url, os.path.join(config_dir_path, "watch_later"), process)
+        active_trackers[video_url] = tracker
+        tracker.start()
         
-        # When MPV closes, stop uploads and notify the frontend.
+        # When MPV closes, upload the final position and notify the frontend.
         def wait_for_mpv():
             process.wait()
-            active_uploads.discard(video_url)
-            print(f"MPV closed. Stopping uploads for {video_url}")
+            print(f"MPV closed. Uploading the final position for {video_url}")
+            tracker.finish()
+            if active_trackers.get(video_url) is tracker:
+                del active_trackers[video_url]
+            if os.name != 'nt' and os.path.exists(ipc_path):
+                os.remove(ipc_path)
             if app_loop:
                 app_loop.call_soon_threadsafe(asyncio.create_task, manager.broadcast("close_video_popup"))
             else:
@@ -375,8 +626,9 @@ async def play_video(request: Request, data: dict = Body(...)):
 
 @app.post("/api/stop_upload", response_class=JSONResponse)
 async def stop_upload():
-    global active_uploads
-    active_uploads.clear()
+    for tracker in list(active_trackers.values()):
+        tracker.stop()
+    active_trackers.clear()
     return {"status": "success", "message": "Position uploads stopped"}
 
 import shutil
@@ -403,17 +655,25 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
-from urllib.parse import unquote
-import requests
-from requests.auth import HTTPBasicAuth
+from urllib.parse import unquote, quote
+from concurrent.futures import ThreadPoolExecutor
 
 # WebDAV credentials and URL (reuse from crawler.py)
 webdav_username = os.getenv('WEBDAV_USERNAME')
 webdav_password = os.getenv('WEBDAV_PASSWORD')
 webdav_url = os.getenv('WEBDAV_URL')
 
+# Number of WebDAV DELETE requests a batch delete runs at once
+DELETE_CONCURRENCY = int(os.getenv("DELETE_CONCURRENCY", "8"))
+
+class DeleteError(Exception):
+    """A delete that failed, with the HTTP status to report it with."""
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
 def webdav_delete(path):
-    """Delete a file or folder on the WebDAV server."""
+    """Delete a file or folder on the WebDAV server (folders are deleted with everything in them)."""
     if not all([webdav_username, webdav_password, webdav_url]):
         raise Exception("WebDAV credentials not set in .env")
     # Ensure path is not double-encoded
@@ -422,13 +682,157 @@ def webdav_delete(path):
     if path_decoded.startswith("/"):
         path_decoded = path_decoded[1:]
     full_url = webdav_url.rstrip("/") + "/" + path_decoded
-    response = requests.request(
-        "DELETE",
-        full_url,
-        auth=HTTPBasicAuth(webdav_username, webdav_password),
-        timeout=60
-    )
-    return response
+    # Per-thread keep-alive session shared with the crawler
+    return crawler.get_session().request("DELETE", full_url, timeout=60)
+
+def webdav_relative_path(rel_path):
+    """Turn a catalog path into a decoded path relative to WEBDAV_URL."""
+    # Remove leading slash if present
+    rel_path = rel_path.lstrip("/")
+    # Remove prefix if present
+    if rel_path.startswith(prefix):
+        rel_path = rel_path[len(prefix):]
+    # URL-decode the path for WebDAV
+    return unquote(rel_path)
+
+def delete_from_webdav(rel_path):
+    """Delete a file or folder on the WebDAV share; raises DeleteError on failure."""
+    rel_path_decoded = webdav_relative_path(rel_path)
+
+    # Prevent deletion of the root directory
+    if rel_path_decoded.strip("/ ") == "":
+        raise DeleteError("Refusing to delete the root directory.", 400)
+
+    # Delete file or folder on WebDAV
+    webdav_response = webdav_delete(rel_path_decoded)
+    if not (200 <= webdav_response.status_code < 300):
+        raise DeleteError(f"WebDAV delete failed: {webdav_response.status_code} {webdav_response.reason} {webdav_response.text}", 404)
+
+def delete_empty_webdav_folder(folder_path):
+    """
+    Delete a WebDAV folder (with a single collection DELETE) once it holds no videos and
+    no subfolders anymore, e.g. only subtitles are left. Returns True if it was deleted.
+    """
+    rel_folder = webdav_relative_path(folder_path).strip("/")
+    if not rel_folder:
+        return False
+    folder_href = urlparse(webdav_url).path.rstrip("/") + "/" + quote(rel_folder) + "/"
+    _, children = crawler.list_collection(folder_href)
+    if any(child["type"] in ("FOLDER", "VIDEO") for child in children):
+        return False
+    response = webdav_delete(rel_folder)
+    return 200 <= response.status_code < 300
+
+def check_delete_path(rel_path):
+    """Raise DeleteError for a path that is not a plain catalog path (e.g. one with .. segments)."""
+    if not isinstance(rel_path, str) or not rel_path.strip("/ "):
+        raise DeleteError("Refusing to delete the root directory.", 400)
+    segments = unquote(rel_path).replace("\\", "/").split("/")
+    if any(segment in (".", "..") for segment in segments):
+        raise DeleteError(f"Invalid path: {rel_path}", 400)
+
+def delete_library_item(rel_path, item_type):
+    """Delete one item from disk or WebDAV; returns the parent folder path to check afterwards, if any."""
+    backend = crawler.find_library_backend(rel_path, library_backends)
+    local_file = backend.local_file_path(rel_path)
+    if local_file:
+        # Local library items are deleted straight from disk
+        if os.path.normpath(local_file) == os.path.normpath(backend.root):
+            raise DeleteError("Refusing to delete the root directory.", 400)
+        if os.path.isdir(local_file):
+            shutil.rmtree(local_file)
+        else:
+            os.remove(local_file)
+        return None
+    delete_from_webdav(rel_path)
+    # When the last video of a folder is deleted, the rest of the folder goes too
+    if item_type == "VIDEO":
+        parent_path = rel_path.rstrip("/").rsplit("/", 1)[0] + "/"
+        if webdav_relative_path(parent_path).strip("/"):
+            return parent_path
+    return None
+
+def delete_items(items):
+    """
+    Delete a batch of {"path", "type"} items (blocking). All paths are validated before
+    anything is deleted; invalid ones are reported as errors. DELETEs run concurrently;
+    items inside a folder that is deleted in the same batch are skipped, and every parent
+    folder is checked once after all deletes. The catalog and OMDb cache are updated in
+    one write for the whole batch. Returns one {"path", "status", "error"?} per item.
+    """
+    results = {}
+    # Every path is validated before anything is deleted
+    for item in items:
+        try:
+            check_delete_path(item["path"])
+        except DeleteError as e:
+            results[item["path"]] = {"path": item["path"], "status": "error", "error": str(e), "status_code": e.status_code}
+    paths = {item["path"] for item in items if item["path"] not in results}
+    to_delete = []
+    covered_by = {}
+    for item in items:
+        path = item["path"]
+        if path in results:
+            continue
+        results[path] = None
+        # Deleting an ancestor folder already deletes this item; it shares that folder's result
+        ancestors = [other for other in paths if other != path and other.endswith("/") and path.startswith(other)]
+        if ancestors:
+            covered_by[path] = min(ancestors, key=len)
+            continue
+        to_delete.append(item)
+
+    def delete_one(item):
+        try:
+            return item, delete_library_item(item["path"], item.get("type")), None
+        except DeleteError as e:
+            return item, None, e
+        except Exception as e:
+            return item, None, DeleteError(str(e))
+
+    deleted_paths = []
+    parent_folders = set()
+    with ThreadPoolExecutor(max_workers=max(1, min(DELETE_CONCURRENCY, len(to_delete)))) as executor:
+        for item, parent_folder, error in executor.map(delete_one, to_delete):
+            if error is not None:
+                results[item["path"]] = {"path": item["path"], "status": "error", "error": str(error), "status_code": error.status_code}
+                continue
+            results[item["path"]] = {"path": item["path"], "status": "deleted"}
+            deleted_paths.append(item["path"])
+            if parent_folder and parent_folder not in paths:
+                parent_folders.add(parent_folder)
+
+        # Folders that only held the deleted videos (and e.g. subtitles) are removed as well
+        folder_results = executor.map(lambda folder: (folder, delete_empty_webdav_folder(folder)), parent_folders)
+        for folder, deleted in folder_results:
+            if deleted:
+                print(f"Deleted folder without remaining videos: {folder}")
+                deleted_paths.append(folder)
+
+    for path, ancestor in covered_by.items():
+        outcome = results[ancestor]
+        if outcome["status"] == "deleted":
+            results[path] = {"path": path, "status": "deleted"}
+        else:
+            results[path] = {"path": path, "status": "error", "error": f"Folder {ancestor} could not be deleted: {outcome['error']}", "status_code": outcome["status_code"]}
+
+    if deleted_paths:
+        # Remove the nodes and their descendants from the catalog in a single write, then
+        # drop the OMDb file records of the removed files (title records are pruned on the next sync)
+        was_fresh = catalog.is_fresh()
+        removed = store.delete_nodes(deleted_paths)
+        store.delete_file_records([node["name"] for node in removed if node.get("type") != "FOLDER" and node.get("name")])
+        # Prune the in-memory catalog and rewrite the snapshot file for the next cold start
+        catalog.remove(deleted_paths, was_fresh)
+        catalog.save_snapshot()
+    return [results[path] for path in dict.fromkeys(item["path"] for item in items)]
+
+async def run_delete_job(items):
+    """Run delete_items(items) as a job in the sync queue, so it never overlaps a sync or refresh."""
+    job = await sync_jobs.wait(sync_jobs.start("delete", kind="delete", run=lambda job: delete_items(items)))
+    if job.status != "succeeded":
+        raise Exception(job.error or f"Delete {job.status}")
+    return job.result
 
 @app.post("/api/delete", response_class=JSONResponse)
 async def api_delete(request: Request, data: dict = Body(...)):
@@ -442,177 +846,34 @@ async def api_delete(request: Request, data: dict = Body(...)):
         if not rel_path or not item_type:
             return JSONResponse(status_code=400, content={"error": "Missing path or type."})
 
-        # Remove leading slash if present
-        rel_path = rel_path.lstrip("/")
-        # Remove prefix if present
-        if rel_path.startswith(prefix):
-            rel_path = rel_path[len(prefix):]
-        # URL-decode the path for WebDAV
-        rel_path_decoded = unquote(rel_path)
-
-        # Prevent deletion of the root directory
-        if rel_path_decoded.strip() == "":
-            return JSONResponse(status_code=400, content={"error": "Refusing to delete the root directory."})
-
-        # Delete file or folder on WebDAV
-        webdav_response = webdav_delete(rel_path_decoded)
-        if not (200 <= webdav_response.status_code < 300):
-            return JSONResponse(
-                status_code=404,
-                content={"error": f"WebDAV delete failed: {webdav_response.status_code} {webdav_response.reason} {webdav_response.text}"}
-            )
-
-        # If deleting a movie file, check if parent folder should also be deleted
-        # Only applies if type is VIDEO
-        if item_type == "VIDEO":
-            import posixpath
-            from xml.etree import ElementTree
-            # Get parent folder path (relative to media root)
-            parent_folder = posixpath.dirname(rel_path_decoded)
-            if parent_folder and parent_folder != ".":
-                # List all items in the parent folder via WebDAV PROPFIND (Depth: 1)
-                webdav_propfind_url = webdav_url.rstrip("/") + "/" + parent_folder
-                headers = {"Depth": "1"}
-                propfind_body = """<?xml version="1.0" encoding="utf-8" ?>
-                    <d:propfind xmlns:d="DAV:">
-                        <d:allprop/>
-                    </d:propfind>"""
-                propfind_response = requests.request(
-                    "PROPFIND",
-                    webdav_propfind_url,
-                    data=propfind_body,
-                    headers=headers,
-                    auth=HTTPBasicAuth(webdav_username, webdav_password),
-                    timeout=60
-                )
-                if propfind_response.status_code in (207, 207):
-                    # Parse XML to get all files/folders in the parent folder (not recursive)
-                    tree = ElementTree.fromstring(propfind_response.content)
-                    files = []
-                    for response in tree.findall("{DAV:}response"):
-                        href = response.find("{DAV:}href")
-                        if href is not None:
-                            path = href.text
-                            # Remove leading webdav path and parent_folder
-                            if path.startswith("/"):
-                                path = path[1:]
-                            if path.startswith(prefix):
-                                path = path[len(prefix):]
-                            # Only consider files inside the parent folder (not the parent itself)
-                            if path and path != parent_folder and not path.endswith("/"):
-                                files.append(path)
-                    # Remove the file that was just deleted from the list
-                    deleted_file_name = posixpath.basename(rel_path_decoded)
-                    files = [f for f in files if posixpath.basename(f) != deleted_file_name]
-                    # Check for any other movie files
-                    movie_exts = (".mkv", ".mp4", ".avi", ".mov", ".wmv", ".flv", ".webm")
-                    other_movies = [f for f in files if f.lower().endswith(movie_exts)]
-                    # Check for subfolders (if any)
-                    subfolders = [f for f in files if "/" in f]
-                    # If no other movie files and no subfolders, delete all files and the folder
-                    if not other_movies and not subfolders:
-                        for f in files:
-                            webdav_delete(posixpath.join(parent_folder, f))
-                        # Delete the folder itself
-                        webdav_delete(parent_folder)
-
-        # Remove from database.json
-        db_path = os.path.join(os.getcwd(), "database.json")
-        if os.path.exists(db_path):
-            try:
-                with open(db_path, "r") as f:
-                    db = json.load(f)
-                def remove_entry(items):
-                    new_items = []
-                    for item in items:
-                        if item.get("path") == data["path"]:
-                            continue
-                        if item.get("type") == "FOLDER" and "children" in item:
-                            item["children"] = remove_entry(item["children"])
-                        new_items.append(item)
-                    return new_items
-                db = remove_entry(db)
-                with open(db_path, "w") as f:
-                    json.dump(db, f, indent=4)
-            except Exception as e:
-                return JSONResponse(status_code=500, content={"error": f"Failed to update database.json: {e}"})
-
-        # Remove from db_cache.json
-        db_cache_path = os.path.join(os.getcwd(), "db_cache.json")
-        if os.path.exists(db_cache_path):
-            try:
-                with open(db_cache_path, "r") as f:
-                    db_cache = json.load(f)
-                db_cache.pop(data["path"], None)
-                with open(db_cache_path, "w") as f:
-                    json.dump(db_cache, f, indent=4)
-            except Exception as e:
-                return JSONResponse(status_code=500, content={"error": f"Failed to update db_cache.json: {e}"})
-
-        # Remove from last_sync.json if present
-        last_sync_path = os.path.join(os.getcwd(), "last_sync.json")
-        if os.path.exists(last_sync_path):
-            try:
-                with open(last_sync_path, "r") as f:
-                    last_sync = json.load(f)
-                if isinstance(last_sync, dict) and data["path"] in last_sync:
-                    del last_sync[data["path"]]
-                    with open(last_sync_path, "w") as f:
-                        json.dump(last_sync, f, indent=4)
-            except Exception:
-                pass  # Ignore errors here
-
+        result = (await run_delete_job([{"path": rel_path, "type": item_type}]))[0]
+        if result["status"] == "error":
+            return JSONResponse(status_code=result["status_code"], content={"error": result["error"]})
         return {"status": "success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-        # Remove from database.json
-        db_path = os.path.join(os.getcwd(), "database.json")
-        if os.path.exists(db_path):
-            try:
-                with open(db_path, "r") as f:
-                    db = json.load(f)
-                def remove_entry(items):
-                    new_items = []
-                    for item in items:
-                        if item.get("path") == data["path"]:
-                            continue
-                        if item.get("type") == "FOLDER" and "children" in item:
-                            item["children"] = remove_entry(item["children"])
-                        new_items.append(item)
-                    return new_items
-                db = remove_entry(db)
-                with open(db_path, "w") as f:
-                    json.dump(db, f, indent=4)
-            except Exception as e:
-                return JSONResponse(status_code=500, content={"error": f"Failed to update database.json: {e}"})
-
-        # Remove from db_cache.json
-        db_cache_path = os.path.join(os.getcwd(), "db_cache.json")
-        if os.path.exists(db_cache_path):
-            try:
-                with open(db_cache_path, "r") as f:
-                    db_cache = json.load(f)
-                db_cache.pop(data["path"], None)
-                with open(db_cache_path, "w") as f:
-                    json.dump(db_cache, f, indent=4)
-            except Exception as e:
-                return JSONResponse(status_code=500, content={"error": f"Failed to update db_cache.json: {e}"})
-
-        # Remove from last_sync.json if present
-        last_sync_path = os.path.join(os.getcwd(), "last_sync.json")
-        if os.path.exists(last_sync_path):
-            try:
-                with open(last_sync_path, "r") as f:
-                    last_sync = json.load(f)
-                if isinstance(last_sync, dict) and data["path"] in last_sync:
-                    del last_sync[data["path"]]
-                    with open(last_sync_path, "w") as f:
-                        json.dump(last_sync, f, indent=4)
-            except Exception:
-                pass  # Ignore errors here
-
-        return {"status": "success"}
+@app.post("/api/delete/batch", response_class=JSONResponse)
+async def api_delete_batch(request: Request, data: dict = Body(...)):
+    """
+    Delete many files or folders in one request.
+    Expects JSON: { "items": [{ "path": "...", "type": "FOLDER" | "VIDEO" }, ...] }
+    Responds with the outcome per path; the type is looked up in the catalog if missing.
+    """
+    try:
+        items = data.get("items")
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) and item.get("path") and isinstance(item["path"], str) for item in items):
+            return JSONResponse(status_code=400, content={"error": "Expected a non-empty list of items with a path."})
+        await get_catalog()
+        for item in items:
+            if not item.get("type"):
+                node = await asyncio.to_thread(catalog.item, item["path"])
+                if node is not None:
+                    item["type"] = "FOLDER" if node.get("type") == "FOLDER" else node.get("file-type")
+
+        results = await run_delete_job(items)
+        failed = [result for result in results if result["status"] == "error"]
+        return {"status": "success" if not failed else "partial", "deleted": len(results) - len(failed), "results": results}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -0,0 +1,449 @@
+import os
+import json
+import sqlite3
+import threading
+from urllib.parse import urlparse
+
+# SQLite database holding the catalog tree, the OMDb cache and sync state.
+DB_PATH = os.path.join(os.getcwd(), "media_center.db")
+# Number of node changes kept for /api/changes; older clients get a full refresh
+CHANGE_LOG_LIMIT = int(os.getenv("CHANGE_LOG_LIMIT", "10000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    position INTEGER NOT NULL,
+    title TEXT,
+    type TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_nodes_parent ON nodes(parent, position);
+CREATE INDEX IF NOT EXISTS idx_nodes_title ON nodes(title);
+
+CREATE TABLE IF NOT EXISTS omdb_titles (
+    query TEXT PRIMARY KEY,
+    title TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_omdb_titles_title ON omdb_titles(title);
+
+CREATE TABLE IF NOT EXISTS omdb_files (
+    file_name TEXT PRIMARY KEY,
+    last_modified TEXT,
+    query TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_omdb_files_query ON omdb_files(query);
+
+CREATE TABLE IF NOT EXISTS catalog_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    version INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT,
+    position INTEGER,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_catalog_changes_version ON catalog_changes(version);
+
+CREATE TABLE IF NOT EXISTS poster_refs (
+    owner TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    PRIMARY KEY (owner, filename)
+);
+CREATE INDEX IF NOT EXISTS idx_poster_refs_filename ON poster_refs(filename);
+
+CREATE TABLE IF NOT EXISTS poster_garbage (
+    filename TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def node_row(node, parent, position):
+    data = {key: value for key, value in node.items() if key != "children"}
+    return (node["path"], parent, position, node.get("title"), node.get("type"), json.dumps(data))
+
+def poster_files(data):
+    """Poster file names a node or OMDb title record (as a JSON string) refers to, including thumbnail variants."""
+    if not data:
+        return set()
+    record = json.loads(data)
+    names = set()
+    if record.get("poster_filename"):
+        names.add(record["poster_filename"])
+    for variant in record.get("poster_variants") or []:
+        for name in (variant.get("jpg"), variant.get("webp")):
+            if name:
+                # Nodes carry variant URLs, title records bare file names
+                names.add(os.path.basename(urlparse(name).path))
+    return names
+
+def iter_node_rows(nodes, parent=None):
+    """Flatten a nested tree into (path, parent, position, title, type, data) rows."""
+    for position, node in enumerate(nodes):
+        yield node_row(node, parent, position)
+        if node.get("children"):
+            yield from iter_node_rows(node["children"], node["path"])
+
+class MetadataStore:
+    """
+    SQLite store (WAL mode) for catalog nodes, OMDb records and sync state.
+    Every thread gets its own connection; writes are serialized with a lock and run in
+    a single transaction each, so a single-item update is a single-row write.
+    Node and OMDb writes only touch rows that changed, so a sync or delete appends a
+    few pages to the write-ahead log, which SQLite checkpoints into the database file
+    (its compaction step); a crash mid-write rolls back to the last commit.
+    Each node write that changes something bumps the catalog version and records
+    add/update/remove entries in catalog_changes.
+    """
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self.transaction() as conn:
+            conn.executescript(SCHEMA)
+            if self._state(conn, "poster_refs_version") is None:
+                self._build_poster_refs(conn)
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self)
+
+    # --- Nodes ---
+
+    def file_paths(self):
+        """Paths of all non-folder nodes, without decoding their data."""
+        return [row[0] for row in self.connection().execute("SELECT path FROM nodes WHERE type IS NOT 'FOLDER'")]
+
+    def load_tree(self):
+        """Rebuild the nested catalog tree from the nodes table."""
+        rows = self.connection().execute("SELECT path, parent, type, data FROM nodes ORDER BY position").fetchall()
+        nodes = {}
+        for path, parent, node_type, data in rows:
+            node = json.loads(data)
+            if node_type == "FOLDER":
+                node["children"] = []
+            nodes[path] = node
+        tree = []
+        for path, parent, node_type, data in rows:
+            if parent is not None and parent in nodes:
+                nodes[parent].setdefault("children", []).append(nodes[path])
+            else:
+                tree.append(nodes[path])
+        return tree
+
+    def has_nodes(self):
+        return self.connection().execute("SELECT 1 FROM nodes LIMIT 1").fetchone() is not None
+
+    def save_tree(self, tree):
+        """Replace the whole catalog (after a sync) in one transaction."""
+        with self.transaction() as conn:
+            old_rows = {row[0]: row for row in conn.execute("SELECT path, parent, position, title, type, data FROM nodes")}
+            self._apply_node_rows(conn, old_rows, iter_node_rows(tree))
+
+    def replace_top_level_nodes(self, remove_paths, new_nodes):
+        """Remove some top-level subtrees and append new top-level subtrees in one transaction."""
+        with self.transaction() as conn:
+            old_rows = {}
+            for path in remove_paths:
+                old_rows.update((row[0], row) for row in self._subtree_rows(conn, path))
+            removed_positions = {row[2] for row in old_rows.values() if row[1] is None}
+            start = conn.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM nodes WHERE parent IS NULL" +
+                (" AND position NOT IN (%s)" % ",".join("?" * len(removed_positions)) if removed_positions else ""),
+                tuple(removed_positions)
+            ).fetchone()[0]
+
+            def new_rows():
+                for offset, node in enumerate(new_nodes):
+                    yield node_row(node, None, start + offset)
+                    if node.get("children"):
+                        yield from iter_node_rows(node["children"], node["path"])
+
+            self._apply_node_rows(conn, old_rows, new_rows())
+
+    def delete_nodes(self, paths):
+        """Delete several nodes and their descendants in one transaction (one catalog version); returns the removed nodes."""
+        with self.transaction() as conn:
+            old_rows = {}
+            for path in paths:
+                old_rows.update((row[0], row) for row in self._subtree_rows(conn, path))
+            self._apply_node_rows(conn, old_rows, ())
+            return [json.loads(row[5]) for row in old_rows.values()]
+
+    def _subtree_rows(self, conn, path):
+        return conn.execute(
+            """
+            WITH RECURSIVE subtree(path) AS (
+                SELECT path FROM nodes WHERE path = ?
+                UNION ALL
+                SELECT nodes.path FROM nodes JOIN subtree ON nodes.parent = subtree.path
+            )
+            SELECT path, parent, position, title, type, data FROM nodes WHERE path IN subtree
+            """,
+            (path,)
+        ).fetchall()
+
+    def _apply_node_rows(self, conn, old_rows, new_rows):
+        """
+        Write the difference between old_rows ({path: row}) and new_rows: rows that are
+        new or changed are upserted, old paths that are not in new_rows are deleted.
+        """
+        changes = []
+        upserts = []
+        seen = set()
+        for row in new_rows:
+            path = row[0]
+            seen.add(path)
+            old_row = old_rows.get(path)
+            if old_row == row:
+                continue
+            upserts.append(row)
+            changes.append(("update" if old_row else "add", path, row[1], row[2], row[5]))
+            self._update_poster_refs(conn, "node:" + path, old_row[5] if old_row else None, row[5])
+        removed = [path for path in old_rows if path not in seen]
+        conn.executemany("DELETE FROM nodes WHERE path = ?", ((path,) for path in removed))
+        conn.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?)", upserts)
+        for path in removed:
+            self._update_poster_refs(conn, "node:" + path, old_rows[path][5], None)
+        changes.extend(("remove", path, old_rows[path][1], None, None) for path in removed)
+        self._record_changes(conn, changes)
+
+    # --- Change log ---
+
+    def _record_changes(self, conn, changes):
+        """Bump the catalog version and log the changes, trimming the log to CHANGE_LOG_LIMIT rows."""
+        if not changes:
+            return
+        version = self._state(conn, "catalog_version", 0) + 1
+        conn.executemany(
+            "INSERT INTO catalog_changes (version, op, path, parent, position, data) VALUES (?, ?, ?, ?, ?, ?)",
+            ((version, op, path, parent, position, data) for op, path, parent, position, data in changes)
+        )
+        self._set_state(conn, "catalog_version", version)
+        cutoff = conn.execute("SELECT MAX(id) - ? FROM catalog_changes", (CHANGE_LOG_LIMIT,)).fetchone()[0]
+        if cutoff is not None and cutoff > 0:
+            trimmed = conn.execute("SELECT MAX(version) FROM catalog_changes WHERE id <= ?", (cutoff,)).fetchone()[0]
+            if trimmed is not None:
+                conn.execute("DELETE FROM catalog_changes WHERE id <= ?", (cutoff,))
+                self._set_state(conn, "changes_trimmed_version", trimmed)
+
+    def catalog_version(self):
+        return self.get_state("catalog_version", 0)
+
+    def changes_since(self, since):
+        """
+        Return (version, changes) with the net change per path after version since, or
+        (version, None) when entries after since were trimmed and a full refresh is needed.
+        """
+        conn = self.connection()
+        # One read transaction so the version, trim mark and entries are consistent
+        conn.execute("BEGIN")
+        try:
+            version = self._state(conn, "catalog_version", 0)
+            if since < self._state(conn, "changes_trimmed_version", 0) or since > version:
+                return version, None
+            latest = {}
+            for change_version, op, path, parent, position, data in conn.execute(
+                "SELECT version, op, path, parent, position, data FROM catalog_changes WHERE version > ? ORDER BY id",
+                (since,)
+            ):
+                latest.pop(path, None)
+                latest[path] = {
+                    "version": change_version,
+                    "op": op,
+                    "path": path,
+                    "parent": parent,
+                    "position": position,
+                    "node": json.loads(data) if data is not None else None
+                }
+            return version, list(latest.values())
+        finally:
+            conn.rollback()
+
+    # --- OMDb records ---
+
+    def load_db_cache(self):
+        """Return the OMDb cache as the {"files": ..., "titles": ...} dict used by crawler.py."""
+        conn = self.connection()
+        return {
+            "files": {name: json.loads(data) for name, data in conn.execute("SELECT file_name, data FROM omdb_files")},
+            "titles": {query: json.loads(data) for query, data in conn.execute("SELECT query, data FROM omdb_titles")}
+        }
+
+    def has_omdb_records(self):
+        return self.connection().execute("SELECT 1 FROM omdb_titles LIMIT 1").fetchone() is not None
+
+    def save_db_cache(self, db):
+        """Bring the OMDb tables in line with the cache dict, writing only records that changed."""
+        with self.transaction() as conn:
+            title_rows = ((query, record.get("title"), json.dumps(record)) for query, record in db["titles"].items())
+            file_rows = ((name, ref.get("last_modified"), ref.get("query"), json.dumps(ref)) for name, ref in db["files"].items())
+            self._apply_rows(conn, "omdb_titles", "query", title_rows, poster_owner="title:")
+            self._apply_rows(conn, "omdb_files", "file_name", file_rows)
+
+    def _apply_rows(self, conn, table, key, rows, poster_owner=None):
+        """Upsert changed rows and delete missing ones; poster_owner keeps poster_refs in step (data is the last column)."""
+        existing = {row[0]: row for row in conn.execute(f"SELECT * FROM {table}")}
+        upserts = []
+        for row in rows:
+            old_row = existing.pop(row[0], None)
+            if old_row != row:
+                upserts.append(row)
+                if poster_owner:
+                    self._update_poster_refs(conn, poster_owner + row[0], old_row[-1] if old_row else None, row[-1])
+        conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", ((name,) for name in existing))
+        if poster_owner:
+            for name, old_row in existing.items():
+                self._update_poster_refs(conn, poster_owner + name, old_row[-1], None)
+        if upserts:
+            placeholders = ", ".join("?" * len(upserts[0]))
+            conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", upserts)
+
+    def delete_file_records(self, file_names):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM omdb_files WHERE file_name = ?", ((name,) for name in file_names))
+
+    # --- Poster references ---
+
+    def _update_poster_refs(self, conn, owner, old_data, new_data):
+        """Move an owner's poster references from old_data to new_data; dropped files become sweep candidates."""
+        old_files, new_files = poster_files(old_data), poster_files(new_data)
+        dropped = old_files - new_files
+        if dropped:
+            conn.executemany("DELETE FROM poster_refs WHERE owner = ? AND filename = ?", ((owner, name) for name in dropped))
+            conn.executemany("INSERT OR IGNORE INTO poster_garbage VALUES (?)", ((name,) for name in dropped))
+        added = new_files - old_files
+        if added:
+            conn.executemany("INSERT OR IGNORE INTO poster_refs VALUES (?, ?)", ((owner, name) for name in added))
+
+    def _build_poster_refs(self, conn):
+        """Fill poster_refs from all stored nodes and title records (databases created before it existed)."""
+        conn.execute("DELETE FROM poster_refs")
+        for path, data in conn.execute("SELECT path, data FROM nodes").fetchall():
+            self._update_poster_refs(conn, "node:" + path, None, data)
+        for query, data in conn.execute("SELECT query, data FROM omdb_titles").fetchall():
+            self._update_poster_refs(conn, "title:" + query, None, data)
+        self._set_state(conn, "poster_refs_version", 1)
+
+    def poster_ref_count(self, filename):
+        return self.connection().execute("SELECT COUNT(*) FROM poster_refs WHERE filename = ?", (filename,)).fetchone()[0]
+
+    def take_unreferenced_posters(self):
+        """
+        Sweep step: return the candidate files that no node or title record references
+        anymore and clear the candidate list (still referenced candidates are just dropped).
+        """
+        with self.transaction() as conn:
+            unreferenced = [row[0] for row in conn.execute(
+                "SELECT filename FROM poster_garbage WHERE NOT EXISTS (SELECT 1 FROM poster_refs WHERE poster_refs.filename = poster_garbage.filename)"
+            )]
+            conn.execute("DELETE FROM poster_garbage")
+            return unreferenced
+
+    # --- Sync state ---
+
+    def get_state(self, key, default=None):
+        return self._state(self.connection(), key, default)
+
+    def set_state(self, key, value):
+        with self.transaction() as conn:
+            self._set_state(conn, key, value)
+
+    def _state(self, conn, key, default=None):
+        row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def _set_state(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (key, json.dumps(value)))
+
+class _Transaction:
+    """Context manager that serializes writers and commits (or rolls back) on exit."""
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store._write_lock.acquire()
+        self.conn = self.store.connection()
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.store._write_lock.release()
+        return False
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the shared store, creating it (and migrating the legacy JSON files) on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MetadataStore()
+            migrate_json_files(_store)
+        return _store
+
+def migrate_json_files(store, base_dir=None):
+    """
+    Import database.json, db_cache.json, last_sync.json and sync_token.json into the
+    store the first time it is opened. Migrated files are renamed to *.migrated.
+    """
+    base_dir = base_dir or os.getcwd()
+
+    def read_json(name):
+        path = os.path.join(base_dir, name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Warning: could not migrate {name}: {e}")
+            return None
+
+    def mark_migrated(name):
+        path = os.path.join(base_dir, name)
+        os.replace(path, path + ".migrated")
+        print(f"Migrated {name} into {os.path.basename(store.path)}")
+
+    tree = read_json("database.json")
+    if tree is not None and not store.has_nodes():
+        store.save_tree(tree)
+        mark_migrated("database.json")
+
+    db_cache = read_json("db_cache.json")
+    if db_cache is not None and not store.has_omdb_records():
+        if not ("files" in db_cache and "titles" in db_cache):
+            import crawler
+            db_cache = crawler.migrate_db_cache(db_cache)
+        store.save_db_cache(db_cache)
+        mark_migrated("db_cache.json")
+
+    last_sync = read_json("last_sync.json")
+    if isinstance(last_sync, dict) and last_sync.get("last_sync") and store.get_state("last_sync") is None:
+        store.set_state("last_sync", last_sync["last_sync"])
+        mark_migrated("last_sync.json")
+
+    sync_token = read_json("sync_token.json")
+    if isinstance(sync_token, dict) and store.get_state("sync_token") is None:
+        store.set_state("sync_token", sync_token.get("sync_token"))
+        mark_migrated("sync_token.json")
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from position_sync import get_position_sync
+
+# While playing, save the position at most this often even without pause/seek
+CHECKPOINT_SECONDS = int(os.getenv("POSITION_CHECKPOINT_SECONDS", "60"))
+CONNECT_TIMEOUT = 15
+WRITE_WATCH_LATER_REQUEST = 100
+
+def new_ipc_path():
+    """A fresh path for mpv's --input-ipc-server (a named pipe on Windows, a Unix socket elsewhere)."""
+    name = f"media-center-mpv-{uuid.uuid4().hex[:12]}"
+    if os.name == 'nt':
+        return rf"\\.\pipe\{name}"
+    return os.path.join(tempfile.gettempdir(), f"{name}.sock")
+
+def watch_later_file(video_url, watch_later_dir):
+    """The file mpv writes the resume position of video_url to (uppercase MD5 of the URL)."""
+    return Path(watch_later_dir) / hashlib.md5(video_url.encode()).hexdigest().upper()
+
+class IpcConnection:
+    """Line-based JSON connection to mpv's IPC server over a Unix socket or a Windows named pipe."""
+    def __init__(self, ipc_path):
+        if os.name == 'nt':
+            self._pipe = open(ipc_path, "r+b", buffering=0)
+            self._sock = None
+        else:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(ipc_path)
+            self._pipe = None
+        self._buffer = b""
+
+    def send(self, command, request_id=None):
+        message = {"command": command}
+        if request_id is not None:
+            message["request_id"] = request_id
+        data = json.dumps(message).encode() + b"\n"
+        if self._sock is not None:
+            self._sock.sendall(data)
+        else:
+            self._pipe.write(data)
+
+    def messages(self):
+        """Yield decoded messages until mpv closes the connection (blocks between events)."""
+        while True:
+            while b"\n" in self._buffer:
+                line, self._buffer = self._buffer.split(b"\n", 1)
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+            chunk = self._sock.recv(4096) if self._sock is not None else self._pipe.read(4096)
+            if not chunk:
+                return
+            self._buffer += chunk
+
+    def close(self):
+        try:
+            if self._sock is not None:
+                self._sock.close()
+            else:
+                self._pipe.close()
+        except OSError:
+            pass
+
+class PlaybackTracker:
+    """
+    Follows one mpv process over its JSON IPC socket and keeps the resume position on
+    WebDAV current. It observes time-pos and pause and listens for seek, end-file and
+    shutdown; on pause, after a seek, every CHECKPOINT_SECONDS of playback and when
+    playback ends it has mpv write its watch_later file and hands it to the shared
+    PositionSync, which coalesces and uploads it. Between events the tracker thread
+    just blocks on the socket.
+    """
+    def __init__(self, ipc_path, video_url, watch_later_dir, process=None):
+        self.ipc_path = ipc_path
+        self.video_url = video_url
+        self.watch_later_path = watch_later_file(video_url, watch_later_dir)
+        self.process = process
+        self.position = None
+        self.paused = False
+        self._saved_position = None
+        self._seeking = False
+        self._connection = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop tracking without a final upload."""
+        self._stopped.set()
+        if self._connection is not None:
+            self._connection.close()
+
+    def finish(self):
+        """Called after mpv exited: wait for the tracker and upload the position mpv saved on quit."""
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if not self._stopped.is_set():
+            self.upload(delay=0)
+        self.stop()
+
+    def _connect(self):
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while not self._stopped.is_set() and time.monotonic() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                return None
+            try:
+                return IpcConnection(self.ipc_path)
+            except OSError:
+                time.sleep(0.2)
+        return None
+
+    def _run(self):
+        print(f"Tracking playback position for {self.video_url}")
+        try:
+            self._connection = self._connect()
+            if self._connection is None:
+                print("Could not connect to the mpv IPC server; the position is uploaded when mpv exits")
+                return
+            self._connection.send(["observe_property", 1, "time-pos"])
+            self._connection.send(["observe_property", 2, "pause"])
+            for message in self._connection.messages():
+                if self._stopped.is_set():
+                    break
+                self._handle(message)
+        except OSError as e:
+            if not self._stopped.is_set():
+                print(f"Playback tracking stopped: {e}")
+        finally:
+            print(f"Stopped tracking playback position for {self.video_url}")
+
+    def _handle(self, message):
+        event = message.get("event")
+        if event == "property-change":
+            if message.get("name") == "time-pos" and message.get("data") is not None:
+                self.position = message["data"]
+                if self._saved_position is None:
+                    # The resume point mpv started from is already saved
+                    self._saved_position = self.position
+                elif not self.paused and not self._seeking and abs(self.position - self._saved_position) >= CHECKPOINT_SECONDS:
+                    self._save("checkpoint")
+            elif message.get("name") == "pause":
+                self.paused = bool(message.get("data"))
+                if self.paused:
+                    self._save("pause")
+        elif event == "seek":
+            self._seeking = True
+        elif event == "playback-restart" and self._seeking:
+            # The seek finished; time-pos now holds the new position
+            self._seeking = False
+            self._save("seek")
+        elif event in ("end-file", "shutdown"):
+            # mpv writes the watch_later file itself on quit (save-position-on-quit);
+            # finish() uploads it once the process is gone
+            self._seeking = False
+        elif message.get("request_id") == WRITE_WATCH_LATER_REQUEST and message.get("error") == "success":
+            self.upload()
+
+    def _save(self, reason):
+        """Ask mpv to write its watch_later file; the reply triggers the upload."""
+        if self.position is None or abs(self.position - self._saved_position) < 1:
+            return
+        self._saved_position = self.position
+        print(f"Saving playback position {self.position:.1f}s ({reason})")
+        self._connection.send(["write-watch-later-config"], WRITE_WATCH_LATER_REQUEST)
+
+    def upload(self, delay=None):
+        """Queue the watch_later file for upload (skipped there if its content is unchanged)."""
+        get_position_sync().submit(self.watch_later_path, delay)
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import crawler
+from position_upload import get_webdav_base
+
+POSITION_FILE_RE = re.compile(r"^[0-9A-F]{32}$")
+# Kept in the working directory with the other runtime state (media_center.db, catalog.snapshot)
+INDEX_PATH = os.path.join(os.getcwd(), "watch_later_index.json")
+
+def position_hash(video_url):
+    """Name of the watch_later file mpv uses for video_url (uppercase MD5 of the URL)."""
+    return hashlib.md5(video_url.encode()).hexdigest().upper()
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+class PositionStore:
+    """
+    Local copies of the watch_later files, indexed by their MD5 name. sync() lists the
+    remote watch_later collection with one Depth: 1 PROPFIND, downloads only files whose
+    ETag changed (as conditional GETs over the thread's keep-alive session) and drops
+    local files of videos that are no longer in the catalog. /api/play still fetch()es
+    the file of the video it starts, so positions saved on another device since the
+    last sync are picked up; for a prefetched copy that is still current that is a 304.
+    The index (watch_later_index.json) remembers each file's remote ETag and the local
+    mtime it was synced at; a local file mpv wrote since then is kept, since
+    PositionSync uploads it.
+    """
+    def __init__(self, watch_later_dir, index_path=INDEX_PATH):
+        self.watch_later_dir = watch_later_dir
+        self.index_path = index_path
+        self._lock = threading.RLock()
+        try:
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _local_path(self, file_hash):
+        return os.path.join(self.watch_later_dir, file_hash)
+
+    def _local_mtime(self, file_hash):
+        try:
+            return os.stat(self._local_path(file_hash)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _save_index(self):
+        crawler.write_json_atomic(self.index_path, self.index)
+
+    def fetch(self, video_url):
+        """Download the position file of one video now (conditional on the known ETag); True if it is on disk."""
+        with self._lock:
+            file_hash = position_hash(video_url)
+            try:
+                found = self._download(file_hash)
+            except requests.RequestException as e:
+                print(f"Failed to download watch-later file {file_hash}: {e}")
+                return False
+            self._save_index()
+            return found
+
+    def _download(self, file_hash, remote_etag=None):
+        """GET one file, with If-None-Match when there is a synced local copy; True if it is on disk."""
+        request_headers = {}
+        entry = self.index.get(file_hash)
+        if entry and entry.get("etag") and self._local_mtime(file_hash) is not None:
+            request_headers['If-None-Match'] = entry["etag"]
+        response = crawler.get_session().get(f"{get_webdav_base()}/watch_later/{file_hash}", headers=request_headers, timeout=30)
+        if response.status_code == 304:
+            return True
+        if response.status_code == 404:
+            self.index.pop(file_hash, None)
+            return False
+        if response.status_code != 200:
+            print(f"Failed to download watch-later file {file_hash}. Status code: {response.status_code}")
+            return self._local_mtime(file_hash) is not None
+        os.makedirs(self.watch_later_dir, exist_ok=True)
+        local_path = self._local_path(file_hash)
+        temp_path = local_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(response.content)
+        os.replace(temp_path, local_path)
+        self.index[file_hash] = {"etag": response.headers.get("ETag") or remote_etag, "mtime": self._local_mtime(file_hash)}
+        return True
+
+    def sync(self, wanted=None, busy=()):
+        """
+        Bring the local files in line with WebDAV. wanted is the set of hashes of videos
+        in the catalog (None keeps and fetches everything); hashes in busy (videos that
+        are playing) are left alone. Returns (downloaded, removed).
+        """
+        collection = urlparse(f"{get_webdav_base()}/watch_later/").path
+        try:
+            _, items = crawler.list_collection(collection)
+        except Exception as e:
+            print(f"Could not list remote watch positions: {e}")
+            return 0, 0
+        remote = {item["name"]: item for item in items if item["type"] != "FOLDER" and POSITION_FILE_RE.match(item["name"])}
+
+        downloaded = 0
+        for file_hash, item in remote.items():
+            if file_hash in busy or (wanted is not None and file_hash not in wanted):
+                continue
+            # Lock per file, so a play request's fetch() never waits for the whole sync
+            with self._lock:
+                entry = self.index.get(file_hash)
+                local_mtime = self._local_mtime(file_hash)
+                if entry and entry.get("etag") == item["etag"] and local_mtime is not None:
+                    continue
+                if local_mtime is not None:
+                    # mpv wrote this file after it was last synced: the local position is newer
+                    changed_locally = entry.get("mtime") != local_mtime if entry else (
+                        (parse_http_date(item["last_modified"]) or 0) < local_mtime / 1e9)
+                    if changed_locally:
+                        self.index[file_hash] = {"etag": item["etag"], "mtime": local_mtime}
+                        continue
+                try:
+                    if self._download(file_hash, item["etag"]):
+                        downloaded += 1
+                except requests.RequestException as e:
+                    print(f"Failed to download watch-later file {file_hash}: {e}")
+
+        with self._lock:
+            removed = self.compact(wanted, busy) if wanted is not None else 0
+            self._save_index()
+        return downloaded, removed
+
+    def compact(self, wanted, busy=()):
+        """Delete local position files (and index entries) of videos that are not in wanted."""
+        with self._lock:
+            removed = 0
+            try:
+                names = os.listdir(self.watch_later_dir)
+            except OSError:
+                names = []
+            for name in names:
+                if POSITION_FILE_RE.match(name) and name not in wanted and name not in busy:
+                    try:
+                        os.remove(self._local_path(name))
+                        removed += 1
+                    except OSError:
+                        pass
+            for file_hash in [file_hash for file_hash in self.index if file_hash not in wanted and file_hash not in busy]:
+                del self.index[file_hash]
+            return removed
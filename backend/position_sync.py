@@ -0,0 +1,116 @@
+import os
+import hashlib
+import threading
+import time
+import requests
+from position_upload import get_auth_header, get_webdav_base
+
+# Position writes for the same file within this window are coalesced into one upload
+DEBOUNCE_SECONDS = float(os.getenv("POSITION_UPLOAD_DEBOUNCE", "3"))
+RETRY_SECONDS = 30
+FLUSH_TIMEOUT = 15
+
+class PositionSync:
+    """
+    Uploads watch_later files to WebDAV for all players. submit() only marks a file as
+    dirty; a single worker uploads it once no new write arrived for DEBOUNCE_SECONDS,
+    skips it when its content hash matches the last upload, and sends everything over
+    one keep-alive session. close() flushes whatever is still pending.
+    """
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._pending = {}
+        self._uploaded = {}
+        self._session = None
+        self._upload_url = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, path, delay=None):
+        """Schedule an upload of path; repeated submits only push the deadline back."""
+        with self._lock:
+            if self._closed:
+                return
+            self._pending[str(path)] = time.monotonic() + (DEBOUNCE_SECONDS if delay is None else delay)
+            self._lock.notify()
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """Upload everything pending now; returns False if uploads remain after timeout."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            for path in self._pending:
+                self._pending[path] = 0
+            self._lock.notify()
+            while self._pending and time.monotonic() < deadline:
+                self._lock.wait(deadline - time.monotonic())
+            return not self._pending
+
+    def close(self):
+        if not self.flush():
+            print(f"Warning: {len(self._pending)} position uploads still pending at shutdown")
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    now = time.monotonic()
+                    due = [path for path, when in self._pending.items() if when <= now]
+                    if due:
+                        break
+                    self._lock.wait(min(self._pending.values()) - now if self._pending else None)
+                if self._closed:
+                    return
+            for path in due:
+                ok = self._upload(path)
+                with self._lock:
+                    # A submit that arrived during the upload keeps its own deadline
+                    if self._pending.get(path, 1) <= time.monotonic():
+                        if ok:
+                            del self._pending[path]
+                        else:
+                            self._pending[path] = time.monotonic() + RETRY_SECONDS
+                    self._lock.notify_all()
+
+    def _upload(self, path):
+        """Upload one file unless its content is what was uploaded last; True when done."""
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            # mpv removed the file (e.g. playback reached the end); nothing to upload
+            return True
+        digest = hashlib.sha1(content).hexdigest()
+        if self._uploaded.get(path) == digest:
+            return True
+        try:
+            if self._session is None:
+                # Auth header and target collection are derived once for all uploads
+                self._upload_url = f"{get_webdav_base()}/watch_later/"
+                self._session = requests.Session()
+                self._session.headers['Authorization'] = get_auth_header()
+            webdav_path = self._upload_url + os.path.basename(path)
+            print(f"Uploading position file to {webdav_path}")
+            response = self._session.put(webdav_path, headers={'Content-Type': 'application/octet-stream'}, data=content, timeout=30)
+            if response.status_code not in (200, 201, 204):
+                print(f"Upload failed with status code {response.status_code}")
+                return False
+        except (requests.RequestException, ValueError, AttributeError) as e:
+            print(f"Failed to upload position file {os.path.basename(path)}: {e}")
+            return False
+        self._uploaded[path] = digest
+        return True
+
+_position_sync = None
+_position_sync_lock = threading.Lock()
+
+def get_position_sync():
+    """Return the shared position uploader, starting its worker on first use."""
+    global _position_sync
+    with _position_sync_lock:
+        if _position_sync is None:
+            _position_sync = PositionSync()
+        return _position_sync
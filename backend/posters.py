@@ -0,0 +1,104 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# Widths (in pixels) of the thumbnails generated for every poster.
+POSTER_WIDTHS = (185, 342, 500)
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+def content_hash(path):
+    """Return a short hash of a file's content, used to name its variants."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+def save_atomic(image, path, image_format, **options):
+    """Save an image to a temp file and rename it, so concurrent writers never interleave."""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        image.save(temp_path, image_format, **options)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def create_poster_variants(source_path, output_dir):
+    """
+    Create JPEG and WebP thumbnails of a poster in every POSTER_WIDTHS size.
+    Variants are named after the hash of the source content, so an unchanged poster
+    maps to the same files and existing variants are not generated again.
+    Returns a list of {"width", "jpg", "webp"} file names ordered by width.
+    """
+    digest = content_hash(source_path)
+    variants = []
+    with Image.open(source_path) as image:
+        image = image.convert("RGB")
+        for width in POSTER_WIDTHS:
+            jpg_name = f"{digest}-{width}.jpg"
+            webp_name = f"{digest}-{width}.webp"
+            jpg_path = os.path.join(output_dir, jpg_name)
+            webp_path = os.path.join(output_dir, webp_name)
+            if not (os.path.exists(jpg_path) and os.path.exists(webp_path)):
+                if image.width > width:
+                    height = round(image.height * width / image.width)
+                    thumbnail = image.resize((width, height), Image.LANCZOS)
+                else:
+                    thumbnail = image
+                save_atomic(thumbnail, jpg_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+                save_atomic(thumbnail, webp_path, "WEBP", quality=WEBP_QUALITY, method=4)
+            variants.append({"width": width, "jpg": jpg_name, "webp": webp_name})
+    return variants
+
+def is_content_hashed(filename):
+    """Variant file names start with the content hash of their source poster."""
+    stem = os.path.splitext(filename)[0]
+    digest, _, width = stem.partition("-")
+    return len(digest) == 20 and width.isdigit() and all(c in "0123456789abcdef" for c in digest)
+
+class PosterCache:
+    """
+    Bounded in-memory LRU of poster bytes keyed by file name. Entries are validated
+    against the file's mtime and size, so a re-downloaded poster is picked up.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, filename):
+        """Return (etag, content) for a poster file, or None if it does not exist."""
+        path = os.path.join(self.directory, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is not None and entry[0] == (stat.st_mtime_ns, stat.st_size):
+                self.entries.move_to_end(filename)
+                return entry[1], entry[2]
+        with open(path, "rb") as f:
+            content = f.read()
+        etag = hashlib.sha1(content).hexdigest()[:20]
+        with self.lock:
+            self._store(filename, ((stat.st_mtime_ns, stat.st_size), etag, content))
+        return etag, content
+
+    def _store(self, filename, entry):
+        previous = self.entries.pop(filename, None)
+        if previous is not None:
+            self.total_bytes -= len(previous[2])
+        if len(entry[2]) > self.max_bytes:
+            return
+        self.entries[filename] = entry
+        self.total_bytes += len(entry[2])
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted[2])
@@ -0,0 +1,173 @@
+import re
+import math
+import heapq
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+# Indexed node fields and how much a match in each of them counts
+SEARCH_FIELDS = (
+    ("title", 10.0),
+    ("director", 4.0),
+    ("actors", 3.0),
+    ("name", 3.0),
+    ("genre", 2.0),
+    ("plot", 1.0)
+)
+# A prefix expands to at most this many index terms (search-as-you-type on "a" stays cheap)
+MAX_PREFIX_TERMS = 64
+EXACT_MATCH_BOOST = 2.0
+TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    """Lowercase, strip accents and split into word tokens."""
+    if not text or text == "N/A":
+        return []
+    text = str(text).casefold()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(char for char in text if not unicodedata.combining(char))
+    return TOKEN_RE.findall(text)
+
+def field_texts(node):
+    return tuple(node.get(field) or "" for field, _ in SEARCH_FIELDS)
+
+class SearchIndex:
+    """
+    Inverted index (term -> {doc id: weight}) over catalog nodes, with a sorted term
+    list for prefix lookups. sync() diffs a new catalog version against what is indexed,
+    so only added, changed or removed nodes touch the postings.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.postings = {}
+        self.terms = []
+        self.docs = {}
+        self.doc_ids = {}
+        self.doc_fields = {}
+        self.doc_terms = {}
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, node, new_terms=None):
+        """
+        Index (or re-index) a single flat node keyed by its path. Bulk callers pass a
+        new_terms list and merge it into the sorted term list once at the end.
+        """
+        with self._lock:
+            if node["path"] in self.doc_ids:
+                self.remove(node["path"])
+            doc_id = self._next_id
+            self._next_id += 1
+            weights = {}
+            for (field, weight), text in zip(SEARCH_FIELDS, field_texts(node)):
+                for token in tokenize(text):
+                    weights[token] = weights.get(token, 0.0) + weight
+            for term, weight in weights.items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = {}
+                    if new_terms is None:
+                        insort(self.terms, term)
+                    else:
+                        new_terms.append(term)
+                posting[doc_id] = weight
+            self.docs[doc_id] = node
+            self.doc_ids[node["path"]] = doc_id
+            self.doc_fields[doc_id] = field_texts(node)
+            self.doc_terms[doc_id] = list(weights)
+
+    def remove(self, path):
+        """Drop a node from the index; returns False if it was not indexed."""
+        with self._lock:
+            doc_id = self.doc_ids.pop(path, None)
+            if doc_id is None:
+                return False
+            for term in self.doc_terms.pop(doc_id):
+                posting = self.postings[term]
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+                    del self.terms[bisect_left(self.terms, term)]
+            del self.docs[doc_id]
+            del self.doc_fields[doc_id]
+            return True
+
+    def remove_subtree(self, path):
+        """Drop a node and everything below it."""
+        with self._lock:
+            prefix = path.rstrip("/") + "/"
+            doomed = [doc_path for doc_path in self.doc_ids if doc_path == path or doc_path.startswith(prefix)]
+            for doc_path in doomed:
+                self.remove(doc_path)
+            return len(doomed)
+
+    def sync(self, nodes):
+        """Bring the index in line with a new list of flat nodes; returns (added/changed, removed)."""
+        with self._lock:
+            seen = set()
+            changed = 0
+            new_terms = []
+            for node in nodes:
+                path = node["path"]
+                seen.add(path)
+                doc_id = self.doc_ids.get(path)
+                if doc_id is not None and self.doc_fields[doc_id] == field_texts(node):
+                    # Same indexed text: keep the postings, refresh the returned item
+                    self.docs[doc_id] = node
+                    continue
+                self.add(node, new_terms)
+                changed += 1
+            if new_terms:
+                self.terms = sorted(set(self.terms).union(new_terms))
+            removed = [path for path in self.doc_ids if path not in seen]
+            for path in removed:
+                self.remove(path)
+            return changed, len(removed)
+
+    def _prefix_terms(self, token):
+        start = bisect_left(self.terms, token)
+        matches = []
+        for term in self.terms[start:start + MAX_PREFIX_TERMS]:
+            if not term.startswith(token):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, query, limit=20, prefix=True):
+        """
+        Return up to limit (score, node) pairs that match every query token, best first.
+        With prefix=True each token also matches terms that start with it (exact
+        matches score higher), so partially typed words already find results.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        with self._lock:
+            total_docs = max(len(self.docs), 1)
+            scores = None
+            # Rarest tokens first keeps the intersections small
+            token_terms = [(token, self._prefix_terms(token) if prefix else ([token] if token in self.postings else [])) for token in tokens]
+            token_terms.sort(key=lambda entry: sum(len(self.postings[term]) for term in entry[1]))
+            for token, terms in token_terms:
+                token_scores = {}
+                for term in terms:
+                    posting = self.postings[term]
+                    idf = math.log(1 + total_docs / len(posting))
+                    boost = EXACT_MATCH_BOOST if term == token else 1.0
+                    for doc_id, weight in posting.items():
+                        if scores is not None and doc_id not in scores:
+                            continue
+                        score = weight * idf * boost
+                        if score > token_scores.get(doc_id, 0.0):
+                            token_scores[doc_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: scores[doc_id] + score for doc_id, score in token_scores.items()}
+                if not scores:
+                    return []
+            best = heapq.nlargest(limit, scores.items(), key=lambda entry: entry[1])
+            return [(score, self.docs[doc_id]) for doc_id, score in best]
@@ -0,0 +1,166 @@
+import json
+import time
+import asyncio
+import threading
+import uuid
+
+class SyncCancelled(Exception):
+    """Raised inside a sync job at its next checkpoint after cancel() was requested."""
+
+class SyncJob:
+    """
+    State of one sync run. The worker thread reports progress through report() and
+    calls checkpoint() between steps; both are safe to call from any thread. kind is
+    "full" for a full sync or names a partial job (e.g. "refresh" of one library backend);
+    result holds what the job's run function returned.
+    """
+    def __init__(self, trigger, on_update, kind="full", key=None, run=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.trigger = trigger
+        self.kind = kind
+        # Partial jobs without a key never join another job
+        self.key = key or (kind if kind == "full" else self.id)
+        self.run = run
+        self.result = None
+        self.status = "queued"
+        self.phase = "starting"
+        self.percent = 0
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._on_update = on_update
+        self._last_percent = None
+        self.done = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "trigger": self.trigger,
+            "kind": self.kind,
+            "status": self.status,
+            "phase": self.phase,
+            "percent": self.percent,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+    @property
+    def running(self):
+        return self.finished_at is None
+
+    def report(self, phase, percent=None):
+        """Update phase/percent; only phase changes and whole-percent steps are pushed."""
+        self.checkpoint()
+        percent = self.percent if percent is None else max(0, min(100, int(percent)))
+        changed = phase != self.phase or percent != self._last_percent
+        self.phase, self.percent = phase, percent
+        if changed:
+            self._last_percent = percent
+            self._on_update(self)
+
+    def checkpoint(self):
+        if self._cancel.is_set():
+            raise SyncCancelled()
+
+    def cancel(self):
+        if self.running:
+            self.status = "cancelling"
+            self._cancel.set()
+            self._on_update(self)
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        if status == "succeeded":
+            self.phase, self.percent = "done", 100
+        self.finished_at = time.time()
+        self._on_update(self)
+
+class SyncJobManager:
+    """
+    Runs sync jobs one at a time, in order, in a worker thread off the event loop. Full
+    syncs run run_sync(job); partial jobs (refreshing one library backend, deletes) bring
+    their own run(job), so they never write the catalog or the OMDb cache concurrently
+    with a sync. A full sync triggered while one is running joins it; any job triggered
+    while an equal one (same key) is queued joins the queued one. Every state change is
+    passed to broadcast() (a coroutine function) as a JSON "sync_progress" message.
+    """
+    def __init__(self, run_sync, broadcast):
+        self.run_sync = run_sync
+        self.broadcast = broadcast
+        self.current = None
+        self.last = None
+        self._queue = []
+        self._runner = None
+        self._loop = None
+
+    def start(self, trigger, kind="full", key=None, run=None):
+        """Queue a job (or join an equal one) and return it; must be called on the event loop."""
+        if kind == "full" or key is not None:
+            key = key or kind
+            if self.current is not None and self.current.key == key == "full":
+                return self.current
+            for job in self._queue:
+                if job.key == key:
+                    return job
+        self._loop = asyncio.get_running_loop()
+        job = SyncJob(trigger, self._publish, kind, key, run)
+        job.done = self._loop.create_future()
+        self._queue.append(job)
+        self._publish(job)
+        if self._runner is None or self._runner.done():
+            self._runner = self._loop.create_task(self._run())
+        return job
+
+    async def wait(self, job=None):
+        """Wait for job (default: the running job, if any) and return it."""
+        job = job or self.current
+        if job is None:
+            return self.last
+        return await asyncio.shield(job.done)
+
+    def cancel(self):
+        """Cancel the running or next queued full sync."""
+        for job in ([self.current] if self.current else []) + self._queue:
+            if job.kind == "full":
+                job.cancel()
+                return job
+        return None
+
+    def status(self):
+        job = self.current or self.last
+        return job.to_dict() if job else {"status": "idle"}
+
+    async def _run(self):
+        while self._queue:
+            job = self.current = self._queue.pop(0)
+            try:
+                # A job cancelled while it was queued never starts
+                job.checkpoint()
+                job.status = "running"
+                self._publish(job)
+                job.result = await asyncio.to_thread(job.run or self.run_sync, job)
+                job.finish("succeeded")
+            except SyncCancelled:
+                print("Sync cancelled")
+                job.finish("cancelled")
+            except Exception as e:
+                print(f"Error during {'sync' if job.kind == 'full' else job.kind}: {str(e)}")
+                job.finish("failed", str(e))
+            finally:
+                self.current = None
+                self.last = job
+                job.done.set_result(job)
+
+    def _publish(self, job):
+        message = json.dumps({"type": "sync_progress", **job.to_dict()})
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._loop.create_task(self.broadcast(message))
+        else:
+            self._loop.call_soon_threadsafe(self._loop.create_task, self.broadcast(message))
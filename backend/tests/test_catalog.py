@@ -0,0 +1,94 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson
+from metadata_store import MetadataStore
+from catalog import Catalog
+
+def library():
+    return [
+        {"path": "/Movies/", "name": "Movies", "type": "FOLDER", "size": 30, "children": [
+            {"path": "/Movies/Dune/", "name": "Dune", "type": "FOLDER", "size": 20, "children": [
+                {"path": "/Movies/Dune/Dune.mkv", "name": "Dune.mkv", "type": "FILE", "file-type": "VIDEO", "size": 20,
+                 "title": "Dune", "year": "2021", "imdb": "8.0", "director": "Denis Villeneuve", "genre": "Sci-Fi"}
+            ]},
+            {"path": "/Movies/Arrival.mkv", "name": "Arrival.mkv", "type": "FILE", "file-type": "VIDEO", "size": 10,
+             "title": "Arrival", "year": "2016", "imdb": "7.9", "director": "Denis Villeneuve", "genre": "Drama"}
+        ]},
+        {"path": "/Shows/", "name": "Shows", "type": "FOLDER", "size": 0, "children": []}
+    ]
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.store = MetadataStore(os.path.join(self.workdir, "media_center.db"))
+        self.snapshot_path = os.path.join(self.workdir, "catalog.snapshot")
+        self.store.save_tree(library())
+        self.catalog = self.new_catalog()
+        self.catalog.load()
+        self.catalog.build()
+
+    def tearDown(self):
+        self.store.connection().close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def new_catalog(self):
+        return Catalog(self.store, self.snapshot_path)
+
+    def test_snapshot_round_trip(self):
+        cold = self.new_catalog()
+        cold.load()
+        # Answered from the mapped snapshot without parsing the tree
+        self.assertIsNotNone(cold._snapshot)
+        self.assertIsNone(cold._tree)
+        self.assertEqual(cold.encoded().body, self.catalog.encoded().body)
+        self.assertEqual(cold.encoded().etag, self.catalog.encoded().etag)
+        self.assertEqual(orjson.loads(cold.encoded().body), library())
+        for path in ("/Movies/", "/Movies", "/Movies/Dune/Dune.mkv"):
+            self.assertEqual(cold.item(path), self.catalog.item(path))
+        for path, depth in ((None, 1), ("/Movies/", 2), ("/Movies/Dune", 1)):
+            self.assertEqual(cold.subtree(path, depth), self.catalog.subtree(path, depth))
+        self.assertEqual(cold.item("/Movies/")["child_count"], 2)
+        self.assertIsNone(cold.item("/Nothing/"))
+
+    def test_query_and_search(self):
+        page = self.catalog.index().query({"year_min": 1900}, sort="year", direction="desc", limit=1)
+        self.assertEqual([item["title"] for item in page["items"]], ["Dune"])
+        self.assertEqual(page["total"], 2)
+        next_page = self.catalog.index().query({"year_min": 1900}, sort="year", direction="desc", limit=1, cursor=page["next_cursor"])
+        self.assertEqual([item["title"] for item in next_page["items"]], ["Arrival"])
+
+        results = self.catalog.search_index().search("villen")
+        self.assertEqual({node["title"] for _, node in results}, {"Dune", "Arrival"})
+
+    def test_remove_updates_indexes_and_snapshot(self):
+        was_fresh = self.catalog.is_fresh()
+        self.store.delete_nodes(["/Movies/Dune/"])
+        self.catalog.remove(["/Movies/Dune/"], was_fresh)
+        self.catalog.save_snapshot()
+        self.assertTrue(self.catalog.is_fresh())
+        self.assertIsNone(self.catalog.item("/Movies/Dune/Dune.mkv"))
+        self.assertEqual(self.catalog.item("/Movies/")["child_count"], 1)
+        self.assertEqual([node["title"] for _, node in self.catalog.search_index().search("dune")], [])
+        self.assertEqual(self.catalog.index().query({"year_min": 1900})["total"], 1)
+
+        # The next cold start maps the rewritten snapshot instead of reading the database
+        cold = self.new_catalog()
+        cold.load()
+        self.assertIsNotNone(cold._snapshot)
+        self.assertEqual(orjson.loads(cold.encoded().body), self.store.load_tree())
+
+    def test_commit_from_elsewhere_makes_catalog_stale(self):
+        self.assertTrue(self.catalog.is_fresh())
+        other = MetadataStore(self.store.path)
+        other.save_tree(library()[:1])
+        self.assertFalse(self.catalog.is_fresh())
+        other.connection().close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import io
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# crawler refuses to import without WebDAV settings; these tests never reach the server
+os.environ.setdefault("WEBDAV_USERNAME", "test")
+os.environ.setdefault("WEBDAV_PASSWORD", "test")
+os.environ.setdefault("WEBDAV_URL", "http://localhost/remote.php/webdav/media")
+
+import requests
+import crawler
+
+ROOT = "/remote.php/webdav/media/"
+
+def propstat(href, name, collection=False, size=0, etag="e1"):
+    resourcetype = "<d:collection/>" if collection else ""
+    return (
+        f"<d:response><d:href>{href}</d:href><d:propstat><d:prop>"
+        f"<d:displayname>{name}</d:displayname>"
+        f"<d:getlastmodified>Sun, 18 Oct 2026 12:00:00 GMT</d:getlastmodified>"
+        f"<d:getcontentlength>{size}</d:getcontentlength>"
+        f"<d:getetag>&quot;{etag}&quot;</d:getetag>"
+        f"<d:resourcetype>{resourcetype}</d:resourcetype>"
+        f"</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+    )
+
+def multistatus(*responses, token=None):
+    sync_token = f"<d:sync-token>{token}</d:sync-token>" if token else ""
+    return f'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:">{"".join(responses)}{sync_token}</d:multistatus>'.encode()
+
+class StreamedResponse:
+    """Just enough of a requests response for iter_propfind_items (raw.read in chunks)."""
+    def __init__(self, content):
+        self.raw = io.BytesIO(content)
+
+class PropfindParserTest(unittest.TestCase):
+    def test_streaming_parser_matches_buffered_parser(self):
+        body = multistatus(
+            propstat(ROOT, "media", collection=True),
+            propstat(ROOT + "Movies/", "Movies", collection=True),
+            propstat(ROOT + "Movies/Dune.2021.mkv", "Dune.2021.mkv", size=1234),
+            propstat(ROOT + "Movies/Dune.2021.srt", "Dune.2021.srt", size=10)
+        )
+        # Tiny chunks split elements and entities across reads
+        with mock.patch.object(crawler, "STREAM_CHUNK_SIZE", 7):
+            streamed = list(crawler.iter_propfind_items(StreamedResponse(body)))
+        self.assertEqual(streamed, list(crawler.iter_buffered_propfind_items(body)))
+        self.assertEqual([item["type"] for item in streamed], ["FOLDER", "FOLDER", "VIDEO", "SUBTITLE"])
+        self.assertEqual(streamed[2]["size"], 1234)
+        self.assertEqual(streamed[2]["etag"], '"e1"')
+
+class SyncCollectionTest(unittest.TestCase):
+    def crawl_state(self):
+        crawl_state = crawler.new_crawl_state()
+        items = [
+            {"href": ROOT, "name": "media", "type": "FOLDER", "last_modified": "", "size": 0, "etag": "r1"},
+            {"href": ROOT + "Movies/", "name": "Movies", "type": "FOLDER", "last_modified": "", "size": 0, "etag": "m1"},
+            {"href": ROOT + "Movies/Old/", "name": "Old", "type": "FOLDER", "last_modified": "", "size": 0, "etag": "o1"},
+            {"href": ROOT + "Movies/Old/Old.mkv", "name": "Old.mkv", "type": "VIDEO", "last_modified": "", "size": 1, "etag": "f1"}
+        ]
+        list(crawler.record_crawl_state(items, crawl_state))
+        return crawl_state
+
+    def test_parse_sync_collection(self):
+        body = multistatus(
+            propstat(ROOT + "Movies/New.mkv", "New.mkv", size=5),
+            "<d:response><d:href>" + ROOT + "Movies/Old/</d:href><d:status>HTTP/1.1 404 Not Found</d:status></d:response>",
+            "<d:response><d:href>" + ROOT + "</d:href><d:status>HTTP/1.1 507 Insufficient Storage</d:status></d:response>",
+            token="token-2"
+        )
+        changed, removed, token, truncated = crawler.parse_sync_collection(body)
+        self.assertEqual([item["href"] for item in changed], [ROOT + "Movies/New.mkv"])
+        self.assertEqual(removed, [ROOT + "Movies/Old/"])
+        self.assertEqual(token, "token-2")
+        self.assertTrue(truncated)
+
+    def test_apply_sync_changes(self):
+        crawl_state = self.crawl_state()
+        changed = [
+            {"href": ROOT + "Movies/New/", "name": "New", "type": "FOLDER", "last_modified": "", "size": 0, "etag": "n1"},
+            {"href": ROOT + "Movies/New/New.mkv", "name": "New.mkv", "type": "VIDEO", "last_modified": "", "size": 5, "etag": "n2"}
+        ]
+        # Children before parents and a removed folder with everything in it
+        self.assertTrue(crawler.apply_sync_changes(crawl_state, list(reversed(changed)), [ROOT + "Movies/Old/"]))
+        hrefs = {item["href"] for item in crawler.iter_crawl_state_items(crawl_state)}
+        self.assertIn(ROOT + "Movies/New/New.mkv", hrefs)
+        self.assertNotIn(ROOT + "Movies/Old/", hrefs)
+        self.assertNotIn(ROOT + "Movies/Old/Old.mkv", hrefs)
+        self.assertNotIn(ROOT + "Movies/Old/", crawl_state["folders"])
+
+    def test_apply_sync_changes_needs_known_parents(self):
+        changed = [{"href": ROOT + "Shows/Unknown/Ep.mkv", "name": "Ep.mkv", "type": "VIDEO", "last_modified": "", "size": 1, "etag": "x"}]
+        self.assertFalse(crawler.apply_sync_changes(self.crawl_state(), changed, []))
+
+    def test_failed_report_falls_back_to_a_crawl(self):
+        session = mock.Mock()
+        session.request.side_effect = requests.ConnectionError("connection reset")
+        with mock.patch.object(crawler, "get_session", return_value=session):
+            self.assertIsNone(crawler.request_sync_collection("token-1"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# crawler refuses to import without WebDAV settings; these tests never reach the server
+os.environ.setdefault("WEBDAV_USERNAME", "test")
+os.environ.setdefault("WEBDAV_PASSWORD", "test")
+os.environ.setdefault("WEBDAV_URL", "http://localhost/remote.php/webdav/media")
+
+import crawler
+import local_library
+from local_library import LocalLibraryBackend
+
+def flatten(tree):
+    for node in tree:
+        yield node
+        yield from flatten(node.get("children") or [])
+
+class LocalLibraryBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.previous_cwd = os.getcwd()
+        # guessit_cache.json and crawl state files are written to the working directory
+        os.chdir(self.workdir)
+        self.root = os.path.join(self.workdir, "library")
+        self.write("Movies/Dune (2021)/Dune.2021.1080p.mkv", b"x" * 10)
+        self.write("Shows/Severance/Season 1/Severance.S01E01.mkv", b"x" * 5)
+        self.backend = LocalLibraryBackend(self.root)
+
+    def tearDown(self):
+        self.backend.stop()
+        os.chdir(self.previous_cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def write(self, relative_path, content=b""):
+        path = os.path.join(self.root, *relative_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def paths(self, tree):
+        return {node["path"] for node in flatten(tree)}
+
+    def root_href(self):
+        return local_library.to_href(self.root, True)
+
+    def href(self, relative_path, is_dir=False):
+        return local_library.to_href(os.path.join(self.root, *relative_path.split("/")), is_dir)
+
+    def test_crawl_builds_tree(self):
+        tree = self.backend.crawl()
+        by_path = {node["path"]: node for node in flatten(tree)}
+        movie = by_path[self.href("Movies/Dune (2021)/Dune.2021.1080p.mkv")]
+        self.assertEqual(movie["size"], 10)
+        self.assertEqual(movie["title"], "Dune")
+        self.assertEqual(by_path[self.href("Shows", True)]["size"], 5)
+        self.assertTrue(self.backend.owns_path(movie["path"]))
+        self.assertEqual(self.backend.local_file_path(movie["path"]), os.path.normpath(movie["path"]))
+
+    def test_paths_outside_the_root_are_refused(self):
+        outside = os.path.join(self.workdir, "outside")
+        os.makedirs(outside)
+        escape = self.root_href() + "../outside/"
+        self.assertFalse(self.backend.owns_path(escape))
+        self.assertFalse(self.backend.owns_path(self.root_href() + "Movies/../../outside/"))
+        with self.assertRaises(ValueError):
+            self.backend.local_file_path(escape)
+        self.assertTrue(self.backend.owns_path(self.href("Movies/../Shows", True)))
+
+    def test_rescan_picks_up_adds_and_deletes(self):
+        self.backend.crawl()
+        self.write("Shows/Severance/Season 2/Severance.S02E01.mkv")
+        shutil.rmtree(os.path.join(self.root, "Movies"))
+        self.backend.schedule_rescan(self.href("Shows/Severance", True))
+        self.backend.schedule_rescan(self.href("Movies", True))
+        self.backend._timer.cancel()
+        self.backend._flush_rescans()
+        paths = self.paths(self.backend.current_tree())
+        self.assertIn(self.href("Shows/Severance/Season 2/Severance.S02E01.mkv"), paths)
+        self.assertNotIn(self.href("Movies", True), paths)
+
+    def test_watch_reports_changes(self):
+        self.backend.crawl()
+        changed = threading.Event()
+        self.backend.watch(lambda backend: changed.set())
+        self.write("Movies/Arrival (2016)/Arrival.2016.mkv")
+        self.assertTrue(changed.wait(10))
+        self.assertIn(self.href("Movies/Arrival (2016)/Arrival.2016.mkv"), self.paths(self.backend.current_tree()))
+
+    def test_guessit_cache_keeps_names_of_other_backends(self):
+        crawler.guess_names({"Other.Show.S01E01.mkv"})
+        tree = self.backend.crawl()
+        with open("guessit_cache.json") as f:
+            names = json.load(f)["names"]
+        self.assertIn("Other.Show.S01E01.mkv", names)
+        self.assertIn("Dune.2021.1080p.mkv", names)
+
+        crawler.prune_guessit_cache(tree)
+        with open("guessit_cache.json") as f:
+            names = json.load(f)["names"]
+        self.assertNotIn("Other.Show.S01E01.mkv", names)
+        self.assertIn("Dune.2021.1080p.mkv", names)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metadata_store import MetadataStore
+
+def movie(path, poster):
+    return {
+        "path": path,
+        "name": os.path.basename(path),
+        "type": "FILE",
+        "poster_filename": poster,
+        "poster_variants": [{"width": 185, "jpg": f"/posters/{poster}-185.jpg", "webp": f"/posters/{poster}-185.webp"}]
+    }
+
+class MetadataStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.store = MetadataStore(os.path.join(self.workdir, "media_center.db"))
+
+    def tearDown(self):
+        self.store.connection().close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_poster_refs_follow_nodes_and_title_records(self):
+        self.store.save_tree([movie("/m/a.mkv", "a.jpg"), movie("/m/b.mkv", "a.jpg")])
+        self.store.save_db_cache({"files": {}, "titles": {"a|2000": {"title": "A", "poster_filename": "a.jpg"}}})
+        self.assertEqual(self.store.poster_ref_count("a.jpg"), 3)
+        self.assertEqual(self.store.poster_ref_count("a.jpg-185.webp"), 2)
+
+        self.store.delete_nodes(["/m/a.mkv"])
+        self.assertEqual(self.store.poster_ref_count("a.jpg"), 2)
+        # Still referenced, so the sweep leaves it alone
+        self.assertEqual(self.store.take_unreferenced_posters(), [])
+
+        self.store.delete_nodes(["/m/b.mkv"])
+        self.store.save_db_cache({"files": {}, "titles": {}})
+        self.assertEqual(self.store.poster_ref_count("a.jpg"), 0)
+        self.assertEqual(set(self.store.take_unreferenced_posters()), {"a.jpg", "a.jpg-185.jpg", "a.jpg-185.webp"})
+        # Candidates are handed out once
+        self.assertEqual(self.store.take_unreferenced_posters(), [])
+
+    def test_change_log(self):
+        self.store.save_tree([movie("/m/a.mkv", "a.jpg"), movie("/m/b.mkv", "b.jpg")])
+        first = self.store.catalog_version()
+        # Writing the same tree again is not a change
+        self.store.save_tree([movie("/m/a.mkv", "a.jpg"), movie("/m/b.mkv", "b.jpg")])
+        self.assertEqual(self.store.catalog_version(), first)
+
+        self.store.save_tree([movie("/m/a.mkv", "a2.jpg"), movie("/m/c.mkv", "c.jpg")])
+        self.store.delete_nodes(["/m/a.mkv"])
+        version, changes = self.store.changes_since(first)
+        self.assertEqual(version, first + 2)
+        ops = {change["path"]: change["op"] for change in changes}
+        # Only the latest change per path is returned
+        self.assertEqual(ops, {"/m/a.mkv": "remove", "/m/b.mkv": "remove", "/m/c.mkv": "add"})
+        self.assertEqual(self.store.changes_since(version), (version, []))
+        # A client ahead of the store needs a full refresh
+        self.assertEqual(self.store.changes_since(version + 1), (version, None))
+
+    def test_trimmed_change_log_asks_for_a_full_refresh(self):
+        with mock.patch("metadata_store.CHANGE_LOG_LIMIT", 2):
+            for number in range(3):
+                self.store.save_tree([movie(f"/m/{number}.mkv", "a.jpg")])
+        version, changes = self.store.changes_since(0)
+        self.assertIsNone(changes)
+        self.assertEqual(version, self.store.catalog_version())
+
+    def test_poster_refs_are_rebuilt_for_existing_databases(self):
+        self.store.save_tree([movie("/m/a.mkv", "a.jpg")])
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM poster_refs")
+            conn.execute("DELETE FROM sync_state WHERE key = 'poster_refs_version'")
+        reopened = MetadataStore(self.store.path)
+        self.assertEqual(reopened.poster_ref_count("a.jpg"), 1)
+        reopened.connection().close()
+
+if __name__ == "__main__":
+    unittest.main()
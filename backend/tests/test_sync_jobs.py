@@ -0,0 +1,77 @@
+import os
+import sys
+import asyncio
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sync_jobs import SyncJobManager
+
+class SyncJobManagerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.events = []
+        self.sync_started = threading.Event()
+        self.release_sync = threading.Event()
+        self.messages = []
+
+        async def broadcast(message):
+            self.messages.append(message)
+
+        self.jobs = SyncJobManager(self.run_sync, broadcast)
+
+    def run_sync(self, job):
+        self.events.append("sync started")
+        self.sync_started.set()
+        self.release_sync.wait(10)
+        job.report("saving", 90)
+        self.events.append("sync saved")
+
+    def record(self, name):
+        def run(job):
+            self.events.append(name)
+            return name
+        return run
+
+    async def wait_for_sync_start(self):
+        while not self.sync_started.is_set():
+            await asyncio.sleep(0.01)
+
+    async def test_delete_waits_for_a_running_sync(self):
+        sync = self.jobs.start("manual")
+        await self.wait_for_sync_start()
+        first = self.jobs.start("delete", kind="delete", run=self.record("delete 1"))
+        second = self.jobs.start("delete", kind="delete", run=self.record("delete 2"))
+        # Deletes without a key never join each other
+        self.assertIsNot(first, second)
+        self.assertEqual(first.status, "queued")
+        self.release_sync.set()
+
+        second = await self.jobs.wait(second)
+        self.assertEqual(self.events, ["sync started", "sync saved", "delete 1", "delete 2"])
+        self.assertEqual((await self.jobs.wait(sync)).status, "succeeded")
+        self.assertEqual(first.result, "delete 1")
+        self.assertEqual(second.result, "delete 2")
+
+    async def test_equal_jobs_join(self):
+        sync = self.jobs.start("manual")
+        await self.wait_for_sync_start()
+        self.assertIs(self.jobs.start("weekly"), sync)
+        refresh = self.jobs.start("filesystem", kind="refresh", key="refresh:0", run=self.record("refresh"))
+        self.assertIs(self.jobs.start("filesystem", kind="refresh", key="refresh:0", run=self.record("refresh")), refresh)
+        self.release_sync.set()
+        await self.jobs.wait(refresh)
+        self.assertEqual(self.events.count("refresh"), 1)
+
+    async def test_cancel_only_targets_full_syncs(self):
+        sync = self.jobs.start("manual")
+        await self.wait_for_sync_start()
+        delete = self.jobs.start("delete", kind="delete", run=self.record("delete"))
+        self.assertIs(self.jobs.cancel(), sync)
+        self.release_sync.set()
+        self.assertEqual((await self.jobs.wait(sync)).status, "cancelled")
+        self.assertEqual((await self.jobs.wait(delete)).status, "succeeded")
+        self.assertNotIn("sync saved", self.events)
+
+if __name__ == "__main__":
+    unittest.main()